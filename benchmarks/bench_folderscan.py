@@ -0,0 +1,106 @@
+""" Compares folderscan.FolderScanner against the os.walk based folder size
+Steamwatcher used before, on a generated tree of small files: a first scan, a
+rescan of the unchanged tree, a rescan after some files grew and after files
+were added, and the tree split over several roots scanned in parallel.
+
+Usage: python benchmarks/bench_folderscan.py [files] [files per folder] """
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import folderscan  # noqa: E402
+
+FILES = 100000
+FILES_PER_FOLDER = 100
+ROOTS = 4
+# share of the files that grow, and of the folders that get a new file
+CHANGED = 0.01
+
+
+def walk_size(start_path):
+    # Watcher.folder_size before folderscan
+    total_size = 0
+    for dirpath, _, filenames in os.walk(start_path):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            if not os.path.islink(filepath):
+                total_size += os.path.getsize(filepath)
+    return total_size
+
+
+def generate_tree(top, files, per_folder):
+    # roots/folders/nested folders/files, like the depots in a download folder
+    folders = list()
+    for index in range(0, files, per_folder):
+        folder = os.path.join(top, "root{}".format(index // per_folder % ROOTS),
+                              "depot{}".format(index // (per_folder * 10)),
+                              "chunk{}".format(index // per_folder))
+        os.makedirs(folder, exist_ok=True)
+        folders.append(folder)
+        for number in range(min(per_folder, files - index)):
+            with open(os.path.join(folder, "{}.bin".format(number)), "wb") as file:
+                file.write(b"\0" * (number % 7))
+    # a tree that was just written would be too recent to cache its listings
+    old = time.time() - 60
+    for dirpath, _, _ in os.walk(top):
+        os.utime(dirpath, (old, old))
+    return folders
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def report(name, walk, scan):
+    (walk_time, walk_total), (scan_time, scan_total) = walk, scan
+    assert walk_total == scan_total, (walk_total, scan_total)
+    print("{:<20} {:12.3f} {:12.3f} {:8.1f}x".format(
+        name, walk_time * 1000, scan_time * 1000, walk_time / scan_time))
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else FILES
+    per_folder = int(sys.argv[2]) if len(sys.argv) > 2 else FILES_PER_FOLDER
+    top = tempfile.mkdtemp()
+    try:
+        folders = generate_tree(top, files, per_folder)
+        scanner = folderscan.FolderScanner()
+        print("{} files in {} folders".format(files, len(folders)))
+        print("{:<20} {:>12} {:>12} {:>9}".format("scan", "walk [ms]", "scanner [ms]", "speedup"))
+        report("first", timed(walk_size, top), timed(scanner.size, top))
+        report("unchanged", timed(walk_size, top), timed(scanner.size, top))
+
+        step = int(1 / CHANGED)
+        for folder in folders[::step]:
+            for number in range(0, per_folder, step):
+                with open(os.path.join(folder, "{}.bin".format(number)), "ab") as file:
+                    file.write(b"grown")
+        report("files grew", timed(walk_size, top), timed(scanner.size, top))
+
+        for folder in folders[::step]:
+            with open(os.path.join(folder, "new.bin"), "wb") as file:
+                file.write(b"new")
+        report("files added", timed(walk_size, top), timed(scanner.size, top))
+
+        # the roots are on one drive here, force them onto the thread pool
+        roots = [os.path.join(top, name) for name in sorted(os.listdir(top))]
+        scanner.drive = lambda path: path
+
+        def walk_roots():
+            return sum(walk_size(root) for root in roots)
+
+        def scan_roots():
+            return sum(scanner.sizes(roots).values())
+        report("{} roots parallel".format(len(roots)), timed(walk_roots), timed(scan_roots))
+    finally:
+        shutil.rmtree(top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+""" Compares slidingwindow.running_median against scipy.signal.medfilt, and the
+centered moving_mean against the old trailing cumulative sum, over a range of
+window sizes.
+
+Usage: python benchmarks/bench_slidingwindow.py [samples] """
+
+import os
+import sys
+import time
+
+import numpy as np
+from scipy import signal as sp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import slidingwindow  # noqa: E402
+
+WINDOWS = (3, 11, 31, 101, 301, 1001)
+# medfilt is O(n k), skip it where a single run would take minutes
+MEDFILT_LIMIT = 10**8
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def trailing_average(a, n):
+    # the moving average the wave filterer used before slidingwindow
+    ret = np.cumsum(a, dtype=float)
+    ret[n:] = ret[n:] - ret[:-n]
+    return ret / n
+
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 10**6
+    x = np.random.default_rng(0).normal(0, 1000, samples)
+    print("{} samples, fast ndimage rank filter: {}".format(samples, slidingwindow.fast_ndimage()))
+    print("{:>6} {:>12} {:>12} {:>9} {:>12} {:>12}".format(
+        "window", "medfilt [s]", "median [s]", "speedup", "cumsum [s]", "mean [s]"))
+    for k in WINDOWS:
+        median_time, _ = timed(slidingwindow.running_median, x, k)
+        if samples * k <= MEDFILT_LIMIT:
+            medfilt_time, _ = timed(sp.medfilt, x, k)
+            medfilt_text = "{:12.3f}".format(medfilt_time)
+            speedup_text = "{:8.1f}x".format(medfilt_time / median_time)
+        else:
+            medfilt_text, speedup_text = "{:>12}".format("skipped"), "{:>9}".format("-")
+        cumsum_time, _ = timed(trailing_average, x, k)
+        mean_time, _ = timed(slidingwindow.moving_mean, x, k)
+        print("{:>6} {} {:12.3f} {} {:12.3f} {:12.3f}".format(
+            k, medfilt_text, median_time, speedup_text, cumsum_time, mean_time))
+
+
+if __name__ == "__main__":
+    main()
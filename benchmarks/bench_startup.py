@@ -0,0 +1,95 @@
+""" Measures the time from launching each GUI script until its first window is
+up. The scripts are run unchanged through a small launcher that replaces the
+point where each one hands over to its event loop, Tk's mainloop, Img2pdf's
+first file dialog or QApplication.exec_, with a function that lets the window
+lay itself out, prints "first window" and quits.
+
+Usage: python benchmarks/bench_startup.py [runs] [script ...] """
+
+import os
+import sys
+import time
+import statistics
+import subprocess
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+# script -> toolkit its window is made with
+SCRIPTS = {"Wav filter.py": "qt", "image kernels.py": "tk", "Img2pdf.py": "tk",
+           "Steamwatcher.py": "tk"}
+MARKER = "first window"
+TIMEOUT = 60
+
+# only the toolkit of the script is imported, so the other one isn't timed
+HOOKS = {
+    "tk": """
+import tkinter
+import tkinter.filedialog
+
+def first_window(window):
+    window.update_idletasks()
+    print(MARKER, flush=True)
+    window.destroy()
+    raise SystemExit
+
+tkinter.Misc.mainloop = lambda self, n=0: first_window(self)
+tkinter.filedialog.askopenfilenames = lambda **options: first_window(tkinter._default_root)
+""",
+    "qt": """
+from PyQt5.QtWidgets import QApplication
+
+def first_window(app):
+    app.processEvents()
+    print(MARKER, flush=True)
+    return 0
+
+QApplication.exec_ = first_window
+""",
+}
+
+LAUNCHER = """
+import sys
+import runpy
+MARKER = {marker!r}
+{hooks}
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def time_to_first_window(script, toolkit):
+    launcher = LAUNCHER.format(marker=MARKER, hooks=HOOKS[toolkit])
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", launcher, script], cwd=SCRIPTS_DIR,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    elapsed = None
+    for line in process.stdout:
+        if line.strip() == MARKER:
+            elapsed = time.perf_counter() - start
+            break
+    try:
+        _, errors = process.communicate(timeout=TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        _, errors = process.communicate()
+    if elapsed is None:
+        lines = errors.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else "exited without showing a window")
+    return elapsed
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    scripts = sys.argv[2:] or list(SCRIPTS)
+    print("{:<20} {:>10} {:>10} {:>10}".format("script", "min [s]", "median [s]", "max [s]"))
+    for script in scripts:
+        try:
+            times = [time_to_first_window(script, SCRIPTS.get(script, "tk")) for _ in range(runs)]
+        except RuntimeError as error:
+            print("{:<20} failed: {}".format(script, error))
+            continue
+        print("{:<20} {:10.3f} {:10.3f} {:10.3f}".format(
+            script, min(times), statistics.median(times), max(times)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+""" Compares vdf.loads against the pyparsing grammar Steamwatcher used before, on
+synthetic library files with a growing number of apps and on an app manifest.
+pyparsing is only timed when it is installed.
+
+Usage: python benchmarks/bench_vdf.py [apps ...] """
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import vdf  # noqa: E402
+
+APPS = (100, 1000, 10000, 100000)
+# pyparsing takes minutes on the largest files
+PYPARSING_LIMIT = 2 * 10**6
+
+
+def library_folders(apps, libraries=4):
+    lines = ['"libraryfolders"', "{"]
+    for library in range(libraries):
+        lines += ['\t"{}"'.format(library), "\t{",
+                  '\t\t"path"\t\t"D:\\\\SteamLibrary{}"'.format(library),
+                  '\t\t"label"\t\t"disk \\"{}\\""'.format(library),
+                  '\t\t"apps"', "\t\t{"]
+        lines += ['\t\t\t"{}"\t\t"{}"'.format(app, app * 7919) for app in range(library, apps, libraries)]
+        lines += ["\t\t}", "\t}"]
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def app_manifest(depots):
+    lines = ['"AppState"', "{", '\t"appid"\t\t"10"', '\t"name"\t\t"Counter-Strike"',
+             '\t"BytesToDownload"\t\t"1000000"', '\t"BytesDownloaded"\t\t"500000"',
+             '\t"InstalledDepots"', "\t{"]
+    for depot in range(depots):
+        lines += ['\t\t"{}"'.format(depot), "\t\t{",
+                  '\t\t\t"manifest"\t\t"{}"'.format(depot * 104729),
+                  '\t\t\t"size"\t\t"{}"'.format(depot * 31), "\t\t}"]
+    lines += ["\t}", "}"]
+    return "\n".join(lines) + "\n"
+
+
+def pyparsing_grammar():
+    # the grammar from Steamwatcher before vdf.py
+    import pyparsing as pp
+    value = pp.Forward()
+    key_value = pp.Group(pp.QuotedString('"', esc_char='\\') + value)
+    expression = pp.Suppress('{') + pp.Dict(pp.ZeroOrMore(key_value)) + pp.Suppress('}')
+    value <<= pp.QuotedString('"', esc_char='\\') | expression
+    return pp.Dict(key_value)
+
+
+def timed(function, *args):
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        function(*args)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > 0.2:
+            return elapsed / runs
+
+
+def main():
+    apps = [int(arg) for arg in sys.argv[1:]] or APPS
+    try:
+        grammar = pyparsing_grammar()
+    except ImportError:
+        grammar = None
+
+    print("{:<22} {:>10} {:>12} {:>14} {:>9}".format(
+        "file", "size [kB]", "vdf [ms]", "pyparsing [ms]", "speedup"))
+    files = [("manifest, 50 depots", app_manifest(50))]
+    files += [("library, {} apps".format(count), library_folders(count)) for count in apps]
+    for name, text in files:
+        result = vdf.loads(text)
+        vdf_time = timed(vdf.loads, text)
+        line = "{:<22} {:10.1f} {:12.3f}".format(name, len(text) / 1000, vdf_time * 1000)
+        if grammar is not None and len(text) <= PYPARSING_LIMIT:
+            assert grammar.parse_string(text).as_dict() == result
+            pyparsing_time = timed(lambda: grammar.parse_string(text).as_dict())
+            line += " {:14.3f} {:8.1f}x".format(pyparsing_time * 1000, pyparsing_time / vdf_time)
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
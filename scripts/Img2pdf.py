@@ -2,34 +2,308 @@
 an image (or multiple) to a PDF file. """
 
 import os
+import sys
+import json
+import time
+import hashlib
+import argparse
 import tkinter as tk
 from tkinter import filedialog
-import colorama
-from fpdf import FPDF
-from PIL import Image
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-def img2pdf(fp, out):
-    file = os.path.basename(fp)
+import pdfstream
+import batchpool
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tga")
+# how often the manifest is written during a batch, in finished images
+MANIFEST_SAVE_EVERY = 100
+
+class Manifest:
+    """ Records the size, mtime and content hash of every input converted into an
+    output folder, in a json file in that folder. Inputs whose size and mtime
+    didn't change are skipped without reading them, inputs that were only touched
+    are recognized by their hash. """
+
+    NAME = ".img2pdf-manifest.json"
+
+    def __init__(self, out):
+        self.path = os.path.join(out, self.NAME)
+        # absolute input path -> {"size", "mtime", "hash", "output", "error"}
+        self.entries = dict()
+        try:
+            with open(self.path) as file:
+                self.entries = json.load(file)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, fp):
+        return self.entries.get(os.path.abspath(fp))
+
+    def is_unchanged(self, fp, retry_failed=True):
+        entry = self.get(fp)
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(fp)
+        except OSError:
+            return False
+        if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+            return False
+        if entry["output"] is None:
+            return not retry_failed
+        return os.path.isfile(entry["output"])
+
+    def update(self, record):
+        if record.get("hash") is None:
+            return
+        self.entries[os.path.abspath(record["input"])] = {
+            "size": record["size"], "mtime": record["mtime"], "hash": record["hash"],
+            "output": record["output"], "error": record["error"]}
+
+    def save(self):
+        # written next to the manifest and moved over it, so an interrupted save
+        # never leaves a truncated manifest behind
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(self.entries, file, indent=1)
+        os.replace(temporary, self.path)
+
+def file_hash(fp):
+    digest = hashlib.sha256()
+    with open(fp, "rb") as file:
+        for chunk in iter(lambda: file.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def output_path(fp, out):
+    return os.path.join(out, os.path.splitext(os.path.basename(fp))[0] + ".pdf")
+
+def load_page(fp):
+    # jpeg files are only parsed up to their header, anything else is decoded once
     try:
-        img = Image.open(fp)
+        return pdfstream.load_image(fp)
     except OSError:
-        print('\033[91m' + "Unable to open corrupted image file: {}".format(fp))
-        return
-    width, height = img.size
+        raise OSError("Unable to open corrupted image file: {}".format(fp))
 
-    pdf = FPDF(unit="pt", format=[width, height])
-    pdf.set_auto_page_break(0)
-    pdf.add_page()
-    pdf.image(fp)
+def img2pdf(fp, out):
+    """ Converts a single image to a one page pdf in the out folder and returns
+    the pdf's path. Raises OSError when the image can't be read or saved. """
+    image = load_page(fp)
+    out_file = output_path(fp, out)
+    try:
+        with pdfstream.PdfWriter(out_file) as pdf:
+            pdf.add_image_page(image)
+    except OSError as error:
+        raise OSError("failed to save to {}: {}".format(out_file, error))
+    return out_file
 
-    out_file = out + "/" + os.path.splitext(file)[0] + ".pdf"
-    pdf.output(out_file, "F")
-    if not os.path.isfile(out_file):
-        print('\033[93m' + "failed to save to {}".format(out_file))
-        return
-    print("saved " + file + " as " + os.path.splitext(file)[0] + ".pdf")
+def convert_file(fp, out, known_hash=None):
+    """ Runs in the worker processes, the result is one record of the summary.
+    With the hash of an earlier conversion, the image is only converted again
+    when its content changed or its pdf is gone. """
+    start = time.perf_counter()
+    record = {"input": fp, "output": None, "status": "converted", "error": None}
+    try:
+        stat = os.stat(fp)
+        record["size"], record["mtime"] = stat.st_size, stat.st_mtime_ns
+        record["hash"] = file_hash(fp)
+        if record["hash"] == known_hash and os.path.isfile(output_path(fp, out)):
+            record["status"] = "unchanged"
+            record["output"] = output_path(fp, out)
+        else:
+            record["output"] = img2pdf(fp, out)
+    except Exception as error:
+        # PIL raises more than OSError for some malformed files
+        record["status"] = "failed"
+        record["error"] = str(error)
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+def find_images(inputs):
+    return batchpool.find_files(inputs, IMAGE_EXTENSIONS)
+
+def run_batch(paths, out, workers=None, max_in_flight=None, progress=print,
+              manifest=None, retry_failed=True, force=False):
+    """ Converts every image in paths on a process pool, with at most max_in_flight
+    images queued at once. progress is called with a line per finished image.
+    With a manifest, images that are unchanged since their last conversion are
+    skipped (unless force is set) and the manifest is kept up to date. Returns a summary dict with the
+    counts, total time and a record per image. """
+    start = time.perf_counter()
+    records = list()
+
+    # unchanged sizes and mtimes are trusted, those images aren't even read
+    if manifest is not None and not force:
+        unchanged = [path for path in paths if manifest.is_unchanged(path, retry_failed)]
+        for path in unchanged:
+            entry = manifest.get(path)
+            records.append({"input": path, "output": entry["output"], "status": "skipped",
+                            "error": entry["error"], "seconds": 0.0})
+        skipped = set(unchanged)
+        paths = [path for path in paths if path not in skipped]
+
+    def arguments():
+        for path in paths:
+            entry = manifest.get(path) if manifest is not None and not force else None
+            yield path, out, entry["hash"] if entry is not None else None
+
+    try:
+        results = batchpool.completed(convert_file, arguments(), workers, max_in_flight)
+        for done_count, (_, future) in enumerate(results, 1):
+            record = future.result()
+            records.append(record)
+            if manifest is not None:
+                manifest.update(record)
+                if done_count % MANIFEST_SAVE_EVERY == 0:
+                    manifest.save()
+            if record["status"] == "failed":
+                progress("[{}/{}] failed {}: {}".format(
+                    done_count, len(paths), record["input"], record["error"]))
+            else:
+                progress("[{}/{}] {} {}".format(
+                    done_count, len(paths), record["status"], record["input"]))
+    finally:
+        if manifest is not None:
+            manifest.save()
+
+    records.sort(key=lambda record: record["input"])
+    count = {status: 0 for status in ("converted", "unchanged", "skipped", "failed")}
+    for record in records:
+        count[record["status"]] += 1
+    return {"output": out, "converted": count["converted"], "failed": count["failed"],
+            "skipped": count["skipped"] + count["unchanged"],
+            "seconds": round(time.perf_counter() - start, 3), "files": records}
+
+def watch(inputs, out, workers=None, max_in_flight=None, interval=5.0, progress=print):
+    """ Converts new and modified images every interval seconds until interrupted.
+    Images modified within the last interval may still be being written, they are
+    picked up by a later round. Images that failed are only retried once they change. """
+    manifest = Manifest(out)
+    print("Watching {} for new or modified images, press Ctrl+C to stop.".format(", ".join(inputs)))
+    try:
+        while True:
+            now = time.time()
+            changed = list()
+            for path in find_images(inputs):
+                try:
+                    settled = now - os.path.getmtime(path) >= interval
+                except OSError:
+                    continue
+                if settled and not manifest.is_unchanged(path, retry_failed=False):
+                    changed.append(path)
+            if changed:
+                summary = run_batch(changed, out, workers, max_in_flight, progress,
+                                    manifest, retry_failed=False)
+                print_summary(summary)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        return 0
+
+def merge_images(paths, out_file, workers=None, max_in_flight=None, progress=print):
+    """ Writes every image in paths as a page of a single pdf, in order. Images are
+    loaded on a process pool while earlier pages are written, pages are streamed
+    to disk as soon as all pages before them are done. Returns a summary like
+    run_batch, failed images are left out of the pdf. """
+    workers = workers or os.cpu_count()
+    max_in_flight = max_in_flight or 2 * workers
+    start = time.perf_counter()
+    records = list()
+
+    with ProcessPoolExecutor(workers) as pool, pdfstream.PdfWriter(out_file) as pdf:
+        # futures in page order, at most max_in_flight loaded images are held
+        pending = deque()
+        paths_left = iter(paths)
+        for path in paths_left:
+            pending.append((path, pool.submit(load_page, path)))
+            if len(pending) >= max_in_flight:
+                break
+        while pending:
+            path, future = pending.popleft()
+            image_start = time.perf_counter()
+            record = {"input": path, "output": out_file, "status": "converted", "error": None}
+            try:
+                pdf.add_image_page(future.result())
+                record["page"] = len(pdf.pages)
+                progress("[{}/{}] added {}".format(len(records) + 1, len(paths), path))
+            except Exception as error:
+                record["status"] = "failed"
+                record["error"] = str(error)
+                progress("[{}/{}] failed {}: {}".format(len(records) + 1, len(paths), path, error))
+            record["seconds"] = round(time.perf_counter() - image_start, 3)
+            records.append(record)
+            for path in paths_left:
+                pending.append((path, pool.submit(load_page, path)))
+                break
+
+    failed = sum(record["status"] == "failed" for record in records)
+    return {"output": out_file, "converted": len(records) - failed, "failed": failed,
+            "seconds": round(time.perf_counter() - start, 3), "files": records}
+
+def print_summary(summary):
+    print("Converted {} of {} images in {:.1f} s{}.".format(
+        summary["converted"], len(summary["files"]), summary["seconds"],
+        ", {} unchanged".format(summary["skipped"]) if summary.get("skipped") else ""))
+    for record in summary["files"]:
+        if record["status"] == "failed":
+            print("  failed {}: {}".format(record["input"], record["error"]))
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(
+        description="Convert images to pdf files without the file dialogs.")
+    parser.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output", help="output directory for one pdf per image")
+    parser.add_argument("--merge", metavar="PDF",
+                        help="write all images as pages of this single pdf instead")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: cpu count)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="maximum number of queued images (default: 2x workers)")
+    parser.add_argument("--summary", help="write the summary as json to this file, - for stdout")
+    parser.add_argument("--force", action="store_true",
+                        help="convert every image, even when the manifest says it is unchanged")
+    parser.add_argument("--watch", type=float, nargs="?", const=5.0, metavar="SECONDS",
+                        help="keep converting new or modified images, polling every 5 seconds")
+    args = parser.parse_args(argv)
+
+    if not args.output and not args.merge:
+        parser.error("either an output directory (-o) or a merged pdf (--merge) is required")
+    if args.watch is not None:
+        if args.merge:
+            parser.error("--watch converts to an output directory, it can't be combined with --merge")
+        os.makedirs(args.output, exist_ok=True)
+        return watch(args.inputs, args.output, args.workers, args.max_in_flight, args.watch)
+    paths = find_images(args.inputs)
+    if not paths:
+        parser.error("no images found")
+
+    # json on stdout replaces the progress lines, so it can be piped
+    quiet = args.summary == "-"
+    progress = (lambda line: None) if quiet else print
+    if args.merge:
+        if os.path.dirname(args.merge):
+            os.makedirs(os.path.dirname(args.merge), exist_ok=True)
+        summary = merge_images(paths, args.merge, args.workers, args.max_in_flight, progress)
+    else:
+        os.makedirs(args.output, exist_ok=True)
+        summary = run_batch(paths, args.output, args.workers, args.max_in_flight, progress,
+                            Manifest(args.output), force=args.force)
+    if quiet:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    else:
+        print_summary(summary)
+        if args.summary:
+            with open(args.summary, "w") as file:
+                json.dump(summary, file, indent=2)
+    return 1 if summary["failed"] else 0
 
 def main():
+    # any command line arguments run the headless batch mode
+    if len(sys.argv) > 1:
+        sys.exit(batch_main(sys.argv[1:]))
+
+    import colorama
     colorama.init()
     root = tk.Tk()
     root.withdraw()
@@ -47,8 +321,11 @@ def main():
         return
 
     print("Saving PDF files to: {}..".format(out_path))
-    for file in files:
-        img2pdf(file, out_path)
+    summary = run_batch(list(files), out_path)
+    for record in summary["files"]:
+        if record["status"] == "failed":
+            print('\033[91m' + record["error"] + '\033[0m')
     print("     Conversion" + '\033[92m' + " finished")
 
-main()
+if __name__ == "__main__":
+    main()
@@ -2,20 +2,119 @@
 and shuts down the computer when they are all finished. """
 
 import os
+import sys
+import argparse
+import glob
+import time
 import signal
 import threading
 import subprocess
-import winreg as reg
 import tkinter as tk
 import tkinter.filedialog
 import tkinter.messagebox
 import tkinter.scrolledtext
-import pyparsing as pp
+
+import vdf
+import folderscan
+import changewatch
+import throughput
+
+# the registry only exists on windows, steam lives in the home folder elsewhere
+try:
+    import winreg as reg
+except ImportError:
+    reg = None
+
+if sys.platform == "win32":
+    SHUTDOWN = ["shutdown", "/s"]
+else:
+    SHUTDOWN = ["shutdown", "-h", "now"]
+# seconds to look for writes before giving up, for steam to finish installing once
+# the downloads are done, and a stalled download is waited for
+DETECT_TIME = 10
+FINISH_TIME = 30
+MAX_STALL_TIME = 30 * 60
+# seconds between two lines of rates in the log
+LOG_INTERVAL = 10
+
+
+class ManifestProgress:
+    """ Download progress of the apps in a steam library, read from the
+    appmanifest_*.acf files steam keeps up to date while it downloads. Only
+    manifests that changed since the last check are parsed again. Apps that are
+    paused or queued also have bytes left, so an app only counts as progressing
+    once its bytes downloaded changed since the watch started. """
+
+    def __init__(self, steamapps):
+        self.steamapps = steamapps
+        # manifest path -> ((size, mtime), app state)
+        self.cache = dict()
+        # appid -> bytes downloaded when it was first seen, and the apps that moved
+        self.first_seen = dict()
+        self.progressed = set()
+
+    # starts judging progress from the manifests as they are now
+    def reset(self):
+        self.first_seen.clear()
+        self.progressed.clear()
+
+    def apps(self):
+        """ Returns {appid: (name, bytes downloaded, bytes to download)} of every app,
+        or None when no manifest could be read, so callers can fall back to
+        walking the download folder. """
+        paths = glob.glob(os.path.join(self.steamapps, "appmanifest_*.acf"))
+        apps = dict()
+        cache = dict()
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                key = (stat.st_size, stat.st_mtime_ns)
+                if path in self.cache and self.cache[path][0] == key:
+                    state = self.cache[path][1]
+                else:
+                    with open(path, encoding="utf-8", errors="replace") as file:
+                        state = vdf.load(file)["AppState"]
+                cache[path] = (key, state)
+            except Exception:
+                # steam may be rewriting the manifest, it is read again next time
+                continue
+            appid = state.get("appid", path)
+            downloaded = int(state.get("BytesDownloaded", 0) or 0)
+            apps[appid] = (state.get("name", "?"), downloaded,
+                           int(state.get("BytesToDownload", 0) or 0))
+            if self.first_seen.setdefault(appid, downloaded) != downloaded:
+                self.progressed.add(appid)
+        self.cache = cache
+        return apps or None
+
+    # apps with bytes left to download
+    def downloading(self):
+        apps = self.apps()
+        if apps is None:
+            return None
+        return {appid: app for appid, app in apps.items() if app[1] < app[2]}
+
+    # apps with bytes left that downloaded something during the watch
+    def progressing(self):
+        apps = self.downloading()
+        if apps is None:
+            return None
+        return {appid: app for appid, app in apps.items() if appid in self.progressed}
+
+    # summed over every app, a finished app keeps its bytes in the total
+    def downloaded(self):
+        apps = self.apps()
+        if apps is None:
+            return None
+        return sum(downloaded for _, downloaded, _ in apps.values())
 
 
 class Watcher:
     def __init__(self):
         self.directories = set()
+        # download folder -> progress read from the manifests of its library
+        self.manifests = dict()
+        self.scanner = folderscan.FolderScanner()
         self.loaded_steam = False
 
     def ask(self):
@@ -26,63 +125,93 @@ class Watcher:
         if self.loaded_steam:
             return
 
-        hkey = reg.OpenKey(reg.HKEY_CURRENT_USER, "Software\\Valve\\Steam")
-        steam_path = reg.QueryValueEx(hkey, "SteamPath")[0]
+        steam_path = self.steam_path()
         # Read the steam vdf file that contains path strings to all
-        # game install directories.
+        # game install directories, linux installs spell it in lower case.
+        paths = [steam_path + "/steamapps/" + name
+                 for name in ("LibraryFolders.vdf", "libraryfolders.vdf")]
+        path = next((path for path in paths if os.path.isfile(path)), paths[0])
         try:
-            file = open(steam_path + "/steamapps/LibraryFolders.vdf").read()
-        except OSError:
-            print("Unable to open {}.".format(
-                steam_path + "/steamapps/LibraryFolders.vdf"))
-        # parse Valve's weird cfg format (its like a shitty version of JSON)
-        # forward declare the value of a key
-        value = pp.Forward()
-        # expression for our dict structure that looks like: ["key1", value]
-        key_value = pp.Group(pp.QuotedString('"') + value)
-        # create a parse structure for value so value looks like: c
-        expression = pp.Suppress(
-            '{') + pp.Dict(pp.ZeroOrMore(key_value)) + pp.Suppress('}')
-        # set our value to be a quoted string follow by the structure we defined,
-        # looks like this in Python:
-        # ["outer_key", { ["inner_key1", value], ["inner_key2", value] } ]
-        # we can acess the above as either a dict or array.
-        value <<= pp.QuotedString('"') | expression
-        parser = pp.Dict(key_value)
-        content = parser.parseString(file)
-
-        for entry in content["libraryfolders"]:
-            for key, val in entry.items():
-                if key == "path":
-                    dlpath = val + "\\steamapps\\downloading"
-                    if os.path.isdir(dlpath):
-                        self.directories.add(dlpath)
+            with open(path, encoding="utf-8") as file:
+                content = vdf.load(file)
+        except (OSError, vdf.VDFError):
+            print("Unable to read {}.".format(path))
+            return
+
+        # older files spell the root key "LibraryFolders"
+        folders = next(iter(content.values()), dict())
+        for key, entry in folders.items():
+            # libraries are blocks with a path, older files map numbers to paths
+            library = entry.get("path") if isinstance(entry, dict) else entry
+            if not library or not (isinstance(entry, dict) or key.isdigit()):
+                continue
+            steamapps = os.path.join(library, "steamapps")
+            dlpath = os.path.join(steamapps, "downloading")
+            if os.path.isdir(dlpath):
+                self.directories.add(dlpath)
+                self.manifests[dlpath] = ManifestProgress(steamapps)
 
         self.loaded_steam = True
 
+    def steam_path(self):
+        if reg is None:
+            return os.path.expanduser("~/.steam/steam")
+        hkey = reg.OpenKey(reg.HKEY_CURRENT_USER, "Software\\Valve\\Steam")
+        return reg.QueryValueEx(hkey, "SteamPath")[0]
+
     def folder_size(self, start_path='.'):
-        total_size = 0
-        for dirpath, _, filenames in os.walk(start_path):
-            for filename in filenames:
-                filepath = os.path.join(dirpath, filename)
-                if not os.path.islink(filepath):
-                    total_size += os.path.getsize(filepath)
-        return total_size
+        return self.scanner.size(start_path)
+
+    # the progress of every directory: bytes downloaded according to the steam
+    # manifests, or the folder size for plain folders and unreadable manifests
+    def measure(self, directories):
+        sizes = dict()
+        folders = list()
+        for dirpath in directories:
+            size = None
+            if dirpath in self.manifests:
+                size = self.manifests[dirpath].downloaded()
+            if size is None:
+                folders.append(dirpath)
+            else:
+                sizes[dirpath] = size
+        sizes.update(self.scanner.sizes(folders))
+        return sizes
 
     def folder_sizes(self):
-        all_sizes = list()
-        for dirpath in self.directories:
-            all_sizes.append(self.folder_size(dirpath))
-        return all_sizes
-
-    def is_updating(self, last_sizes: list, new_sizes: list):
-        for last_size, new_size in zip(last_sizes, new_sizes):
-            if new_size != last_size:
-                return True
-        return False
+        sizes = self.measure(self.directories)
+        return [sizes[dirpath] for dirpath in sorted(self.directories)]
+
+    # (name, bytes downloaded, bytes to download) of every app steam is downloading
+    def downloading_apps(self):
+        apps = list()
+        for dirpath in sorted(self.manifests):
+            downloading = self.manifests[dirpath].downloading()
+            if downloading:
+                apps.extend(downloading.values())
+        return apps
+
+    # {directory: bytes left to download}, None for folders without manifests.
+    # paused and queued apps are left out, they would keep the watch from finishing
+    def remaining(self):
+        remaining = dict()
+        for dirpath in sorted(self.directories):
+            progressing = None
+            if dirpath in self.manifests:
+                progressing = self.manifests[dirpath].progressing()
+            if progressing is not None:
+                progressing = sum(total - done for _, done, total in progressing.values())
+            remaining[dirpath] = progressing
+        return remaining
+
+    def reset_progress(self):
+        for progress in self.manifests.values():
+            progress.reset()
 
     def clear(self):
         self.directories.clear()
+        self.manifests.clear()
+        self.scanner.clear()
         self.loaded_steam = False
 
     def get_folders(self):
@@ -90,7 +219,8 @@ class Watcher:
 
 
 class Application:
-    def __init__(self):
+    def __init__(self, options=None):
+        self.options = options or parse_args([])
         self.watcher = Watcher()
 
         self.window = tk.Tk()
@@ -131,6 +261,7 @@ class Application:
         self.stop_btn.pack(side=tk.LEFT)
 
         self.thread = None
+        self.backend = None
         self.running = False
 
         self.timer = threading.Event()
@@ -181,42 +312,90 @@ class Application:
         self.running = True
         self.timer.clear()
         self.log("Checking for active downloads.. \n")
+        self.watcher.reset_progress()
+        self.backend = changewatch.create_backend(
+            self.watcher.get_folders(), self.watcher.measure)
+        try:
+            finished = self.watch_downloads(self.backend)
+        finally:
+            self.backend.close()
+            self.running = False
+        if finished:
+            subprocess.call(SHUTDOWN)
 
-        last_size = self.watcher.folder_sizes()  # random initial value
-        self.timer.wait(timeout=10)
-        new_size = self.watcher.folder_sizes()  # random initial value
-
-        if self.timer.is_set():
+    # returns True once the downloads finished, False when there were none or stopped
+    def watch_downloads(self, backend):
+        activity = None if self.timer.is_set() else backend.wait(DETECT_TIME)
+        if activity is None:
             self.log("Watcher stopped. \n", color="red")
-            self.running = False
-            return
+            return False
 
-        if last_size == new_size:
+        if not any(writes for writes, _ in activity.values()):
             self.log("No active downloads found. \n", color="red")
-            self.running = False
-            return
+            return False
         else:
             self.log("Updates ")
             self.log("found. \n", color="green")
+            for name, downloaded, total in self.watcher.downloading_apps():
+                self.log("  {}: {:.0%} of {:.1f} MB \n".format(
+                    name, downloaded / total, total / 2**20))
             self.log("Updating.. \n")
 
-        while self.watcher.is_updating(last_size, new_size):
-            last_size = self.watcher.folder_sizes()
-            if not self.timer.is_set():
-                self.timer.wait(timeout=60)
-
-            if self.timer.is_set():
+        # done once every folder is idle and no manifest has bytes left, a folder
+        # that is idle with bytes left is a stalled download
+        rates = throughput.Throughput(backend.directories, self.options.stall_rate,
+                                      self.options.stall_time)
+        last_log = time.monotonic()
+        stalled = False
+        while True:
+            activity = backend.wait(backend.interval)
+            if activity is None:
                 self.log("Watcher stopped. \n", color="red")
-                self.running = False
-                return
-            new_size = self.watcher.folder_sizes()
-
+                return False
+            rates.add(activity)
+
+            remaining = None
+            if time.monotonic() - last_log >= LOG_INTERVAL:
+                last_log = time.monotonic()
+                remaining = self.watcher.remaining()
+                self.log_rates(rates, remaining)
+            if not rates.idle():
+                stalled = False
+                continue
+
+            if remaining is None:
+                remaining = self.watcher.remaining()
+            if not any(remaining.values()):
+                break
+            if not stalled:
+                stalled = True
+                self.log("Download stalled.. \n", color="orange")
+            if rates.idle_time() >= self.options.max_stall:
+                self.log("Download stalled for too long, not shutting down. \n", color="red")
+                return False
+
+        self.export(rates)
         self.log("Finishing up.. \n")
-        self.timer.wait(timeout=300)
+        if self.timer.wait(timeout=self.options.finish_time):
+            self.log("Watcher stopped. \n", color="red")
+            return False
         self.log("Updating finished. \n")
         self.log("Shutting down computer. \n")
-        self.running = False
-        subprocess.call(["shutdown", "/s"])
+        return True
+
+    def log_rates(self, rates, remaining):
+        self.log("{} (ETA {}) \n".format(
+            throughput.format_rate(rates.rate()),
+            throughput.format_eta(rates.eta(remaining))))
+        self.export(rates)
+
+    def export(self, rates):
+        if not self.options.export:
+            return
+        try:
+            rates.export(self.options.export)
+        except OSError as error:
+            self.log("Unable to export rates: {} \n".format(error), color="red")
 
     def watch_thread(self):
         if self.running:
@@ -236,6 +415,8 @@ class Application:
             return
         self.running = False
         self.timer.set()
+        if self.backend is not None:
+            self.backend.interrupt()
 
     def run(self):
         self.window.mainloop()
@@ -248,8 +429,29 @@ class Application:
             self.window.destroy()
 
 
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Shuts the computer down once the watched downloads are finished.")
+    parser.add_argument("--stall-rate", type=float, default=throughput.STALL_RATE / 1024,
+                        help="KB/s below which a folder counts as idle (default %(default)s)")
+    parser.add_argument("--stall-time", type=float, default=throughput.STALL_TIME,
+                        help="seconds of idle folders before the downloads count as done "
+                             "(default %(default)s)")
+    parser.add_argument("--max-stall", type=float, default=MAX_STALL_TIME,
+                        help="seconds a download with bytes left may stall before the watcher "
+                             "gives up without shutting down (default %(default)s)")
+    parser.add_argument("--finish-time", type=float, default=FINISH_TIME,
+                        help="seconds to wait for steam to install before shutting down "
+                             "(default %(default)s)")
+    parser.add_argument("--export", metavar="FILE",
+                        help="keep the measured rates in FILE, json for .json and csv otherwise")
+    options = parser.parse_args(argv)
+    options.stall_rate *= 1024
+    return options
+
+
 def main():
-    app = Application()
+    app = Application(parse_args(sys.argv[1:]))
     app.run()
 
 
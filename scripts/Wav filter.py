@@ -1,8 +1,12 @@
 # ------------------------------------------------------
 # ---------------------- main.py -----------------------
 # ------------------------------------------------------
+import os
+import sys
+import argparse
+
 from PyQt5.QtWidgets import*
-from PyQt5.uic import loadUi
+from PyQt5.QtCore import QThreadPool
 
 from matplotlib.backends.backend_qt5agg import (
     NavigationToolbar2QT as NavigationToolbar)
@@ -10,17 +14,79 @@ from matplotlib.backends.backend_qt5agg import (
 import numpy as np
 import random
 import mplwidget
-import wave
-from scipy import signal as sp
-
-
-class MatplotlibWidget(QMainWindow):
+import struct
+import wavio
+import blockfilters
+import spectrum
+import stft
+import jobs
+import batchpool
+# generated from untitled.ui with: pyuic5 untitled.ui -o ui_untitled.py
+from ui_untitled import Ui_MainWindow
+
+# number of samples filtered at once, bounds the memory used by a filter run
+BLOCK_SIZE = 2**18
+# command line names of the filters in the filter box
+FILTERS = {"median": "Median", "average": "Moving Average", "fir": "FIR"}
+
+
+# creates a stateful block filter, size is the window of the median and moving average
+# filters and taps and cutoff (relative to nyquist) configure the FIR lowpass
+def create_block_filter(method, size, taps, cutoff, framerate):
+    if method == 'Median':
+        return blockfilters.MedianBlockFilter(size // 2 * 2 + 1)
+    elif method == 'Moving Average':
+        return blockfilters.MovingAverageBlockFilter(size)
+    elif method == 'FIR':
+        b = blockfilters.design_fir(taps, cutoff, framerate)
+        return blockfilters.FIRBlockFilter(b)
+    else:
+        return None
+
+
+# filters every channel of a file block by block and streams it to disk in the same format,
+# run as a job it reports its progress and a cancelled run removes the partial file
+def filter_wav(reader, path, block_filter, job=None):
+    done = 0
+    with wavio.WavWriter(path, reader.channels, reader.framerate,
+                         reader.sample_width, reader.format) as writer:
+        for block in blockfilters.filter_blocks(reader.blocks(BLOCK_SIZE), block_filter):
+            if job is not None and job.cancelled:
+                break
+            writer.write(block)
+            done += len(block)
+            if job is not None:
+                job.report(None, done / max(reader.frames, 1))
+    if job is not None and job.cancelled:
+        os.remove(path)
+        return None
+    return path
+
+
+# job work that filters data block by block, reporting the filtered part as it grows
+def filter_work(data, block_filter):
+    def work(job):
+        output = np.empty(len(data))
+        done = 0
+        for block in blockfilters.filter_blocks(blockfilters.array_blocks(data, BLOCK_SIZE),
+                                                block_filter):
+            if job.cancelled:
+                return None
+            output[done:done + len(block)] = block
+            done += len(block)
+            job.report(output[:done], done / len(data))
+        return output
+    return work
+
+
+class MatplotlibWidget(QMainWindow, Ui_MainWindow):
 
     def __init__(self):
 
         QMainWindow.__init__(self)
 
-        loadUi("untitled.ui", self)
+        # the compiled ui module is much faster than parsing untitled.ui with loadUi
+        self.setupUi(self)
 
         self.setWindowTitle("Wave Filterer")
 
@@ -30,6 +96,7 @@ class MatplotlibWidget(QMainWindow):
 
         self.filter_freq_button.clicked.connect(self.on_filter_frequency)
         self.reset_button.clicked.connect(self.reset)
+        self.save_button.clicked.connect(self.save_filtered)
 
         self.taps_input.setValue(6)
         self.cutoff_input.setValue(0.1)
@@ -38,15 +105,32 @@ class MatplotlibWidget(QMainWindow):
 
         self.addToolBar(NavigationToolbar(self.MplWidget.canvas, self))
 
-        self.wavFile = None
+        self.reader = None
         self.timeData = None
         self.freqData = None
-
-    #moving average filter using cummulative summing as described by: https://numpy.org/doc/stable/reference/generated/numpy.cumsum.html
-    def moving_average(self, a, n=3):
-        ret = np.cumsum(a, dtype=float)
-        ret[n:] = ret[n:] - ret[:-n]
-        return ret / n
+        # min/max pyramids of the original signals, built once per file
+        self.timePyramid = None
+        self.freqPyramid = None
+        self.spectra = spectrum.SpectrumManager()
+        # at most one job per axis, with the line its partial results are drawn on
+        self.pool = QThreadPool.globalInstance()
+        self.jobs = [None, None]
+        self.partial_lines = [None, None]
+        # saving runs next to the plot jobs, it doesn't belong to an axis
+        self.save_job = None
+
+        # changed settings make running jobs stale
+        self.median_filter_slider.valueChanged.connect(self.cancel_jobs)
+        self.moving_average_slider.valueChanged.connect(self.cancel_jobs)
+        self.taps_input.valueChanged.connect(self.cancel_jobs)
+        self.cutoff_input.valueChanged.connect(self.cancel_jobs)
+        self.filter_box.currentIndexChanged.connect(self.cancel_jobs)
+
+        # spectrogram view of the frequency axis
+        self.stft = stft.STFTManager(self.window_input.value(), self.hop_input.value())
+        self.spectrogram_box.toggled.connect(self.on_spectrogram_toggled)
+        self.window_input.valueChanged.connect(self.on_stft_settings)
+        self.hop_input.valueChanged.connect(self.on_stft_settings)
 
     # file dialog for opening wav files
     def file_dialog(self):
@@ -55,81 +139,318 @@ class MatplotlibWidget(QMainWindow):
             self, "QFileDialog.getOpenFileName()", "", "Wave Files (*.wav)", options=options)
 
         try:
-            self.wavFile = wave.open(file_path, 'r')
-        except:
-            print("invalid file (not 16bit signed WAV")
+            self.reader = wavio.WavReader(file_path)
+        except (OSError, ValueError, struct.error):
+            print("invalid file (not an 8/16/24/32 bit PCM or float WAV)")
             return
 
-        self.timeData = np.frombuffer(
-            self.wavFile.readframes(self.wavFile.getnframes()), dtype=np.int16)
-        self.timeData = self.timeData[0::2]
-        self.freqData = abs(np.fft.rfft(self.timeData))
+        self.cancel_jobs()
+
+        # first channel, a memory mapped view for 16 bit files so pages are read on access
+        self.timeData = self.reader.samples(0)
+        self.spectra.clear()
+        self.stft.clear()
+        self.freqData = None
+        self.timePyramid = None
+        self.freqPyramid = None
 
         self.plot_and_update()
 
-    # perform time data filtering and update the canvas
+    # filter the time data in the background, the canvas updates as blocks come in
     def on_filter_time(self):
         if self.timeData is None:
             return
-        s = self.filter_box.currentText()
-        filteredData = self.get_filtered_data(self.timeData, self.filter_box.currentText())
-        self.MplWidget.canvas.axes[0].plot(np.arange(self.wavFile.getnframes()) / self.wavFile.getframerate(), filteredData)
-
-        if self.reflect_freq_box.isChecked():
-            filteredFreqData = abs(np.fft.rfft(filteredData))
-            self.MplWidget.canvas.axes[1].plot(filteredFreqData)
-
-        self.MplWidget.canvas.draw()
-
-    # filters a 1D data array based on the method selected in the qt5 gui
-    def get_filtered_data(self, data, method):
+        block_filter = self.make_block_filter(self.filter_box.currentText())
+        if block_filter is None:
+            return
+        self.start_job(0, "time filter", filter_work(self.timeData, block_filter),
+                       self.on_time_filtered)
+
+    def on_time_filtered(self, filteredData):
+        if self.spectrogram_box.isChecked():
+            self.MplWidget.plot_spectrogram(1, filteredData, self.reader.framerate, self.stft)
+            self.MplWidget.canvas.draw_idle()
+        elif self.reflect_freq_box.isChecked():
+            self.start_job(1, "rfft", lambda job: self.spectra.magnitude(filteredData),
+                           lambda result: self.show_fft_timing())
+
+    # creates a stateful block filter from the settings in the qt5 gui
+    def make_block_filter(self, method):
         if method == 'Median':
-            k = self.median_filter_slider.value() // 2 * 2 + 1
-            return sp.medfilt(data, k)
-        elif method == 'Moving Average':
-            k = self.moving_average_slider.value()
-            return self.moving_average(data, k)
-        elif method == 'FIR':
-            print(self.cutoff_input.value()) 
-            print(self.taps_input.value())
-            b = sp.firwin(self.taps_input.value(), self.cutoff_input.value())
-            return sp.lfilter(b, [1.0], data)
+            size = self.median_filter_slider.value()
         else:
-            return None
+            size = self.moving_average_slider.value()
+        return create_block_filter(method, size, self.taps_input.value(),
+                                   self.cutoff_input.value(), self.reader.framerate)
+
+    # filter every channel of the loaded file block by block and stream it to disk
+    def save_filtered(self):
+        if self.reader is None:
+            return
+        method = self.filter_box.currentText()
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, "QFileDialog.getSaveFileName()", "", "Wave Files (*.wav)")
+        if not file_path:
+            return
 
-    # perform frequency data filtering and update the canvas
+        # the loaded file is memory mapped, truncating it would crash the process
+        if os.path.exists(file_path) and os.path.samefile(file_path, self.reader.path):
+            QMessageBox.warning(self, "Warning", "The loaded file can't be overwritten.")
+            return
+
+        # a single filter processes all channels of a block at once
+        block_filter = self.make_block_filter(method)
+        if block_filter is None:
+            return
+        reader = self.reader
+        job = jobs.Job("save", lambda job: filter_wav(reader, file_path, block_filter, job))
+        job.signals.progress.connect(self.on_save_progress)
+        job.signals.finished.connect(self.on_save_finished)
+        job.signals.failed.connect(self.on_save_failed)
+        self.save_job = job
+        self.save_button.setEnabled(False)
+        self.statusbar.showMessage("saving...")
+        self.pool.start(job)
+
+    def on_save_progress(self, job, partial, fraction):
+        self.statusbar.showMessage("saving: {:.0%}".format(fraction))
+
+    def on_save_finished(self, job, path):
+        self.save_job = None
+        self.save_button.setEnabled(True)
+        self.statusbar.showMessage("saved {}".format(path))
+
+    # errors like a target that can't be written end up here instead of in the slot
+    def on_save_failed(self, job, error):
+        self.save_job = None
+        self.save_button.setEnabled(True)
+        self.statusbar.clearMessage()
+        QMessageBox.warning(self, "Warning", "Saving failed: {}".format(
+            error.strip().splitlines()[-1]))
+
+    # filter the spectrum in the background, the canvas updates as blocks come in
     def on_filter_frequency(self):
-        if self.freqData is None: 
+        if self.timeData is None or self.spectrogram_box.isChecked():
+            return
+        block_filter = self.make_block_filter(self.filter_box.currentText())
+        if block_filter is None:
             return
-        s = self.filter_box.currentText()
-        filteredData = self.get_filtered_data(self.freqData, self.filter_box.currentText())
-        self.MplWidget.canvas.axes[1].plot(filteredData)
+        self.start_job(1, "frequency filter", filter_work(self.frequency_data(), block_filter),
+                       self.on_frequency_filtered)
 
+    def on_frequency_filtered(self, filteredData):
         if self.reflect_time_box.isChecked():
-            filteredTimeData = np.fft.irfft(filteredData, len(self.timeData))
-            self.MplWidget.canvas.axes[0].plot(np.arange(self.wavFile.getnframes()) /
-                                               self.wavFile.getframerate(), filteredTimeData)
+            length = len(self.timeData)
+            self.start_job(0, "irfft", lambda job: self.spectra.irfft(filteredData, length),
+                           lambda result: self.show_fft_timing())
+
+    # runs work on the thread pool, replacing the job that is running for the same axis
+    def start_job(self, axis, name, work, done=None):
+        self.cancel_job(axis)
+        job = jobs.Job(name, work, axis, done)
+        job.signals.progress.connect(self.on_job_progress)
+        job.signals.finished.connect(self.on_job_finished)
+        job.signals.failed.connect(self.on_job_failed)
+        self.jobs[axis] = job
+        self.statusbar.showMessage("{}...".format(name))
+        self.pool.start(job)
+
+    def cancel_job(self, axis):
+        if self.jobs[axis] is not None:
+            self.jobs[axis].cancel()
+            self.jobs[axis] = None
+        if self.partial_lines[axis] is not None:
+            self.MplWidget.remove_decimated(self.partial_lines[axis])
+            self.partial_lines[axis] = None
+            self.MplWidget.canvas.draw_idle()
+
+    def cancel_jobs(self):
+        for axis in range(len(self.jobs)):
+            self.cancel_job(axis)
+
+    # shows the partial result on a line that keeps growing until the job is done,
+    # its envelope pyramid is extended with the new samples instead of rebuilt
+    def on_job_progress(self, job, partial, fraction):
+        if self.jobs[job.axis] is not job:
+            return
+        line = self.partial_lines[job.axis]
+        if line is None:
+            self.partial_lines[job.axis] = self.MplWidget.plot_decimated(
+                job.axis, partial, self.x_scale(job.axis))
+        else:
+            self.grow_line(line, partial, self.x_scale(job.axis))
+        self.statusbar.showMessage("{}: {:.0%}".format(job.name, fraction))
+        self.MplWidget.canvas.draw_idle()
 
-        self.MplWidget.canvas.draw()
+    def on_job_finished(self, job, result):
+        # results of cancelled or replaced jobs can still be queued
+        if self.jobs[job.axis] is not job:
+            return
+        self.jobs[job.axis] = None
+        line = self.partial_lines[job.axis]
+        self.partial_lines[job.axis] = None
+        if line is None:
+            self.MplWidget.plot_decimated(job.axis, result, self.x_scale(job.axis))
+        else:
+            self.grow_line(line, result, self.x_scale(job.axis))
+        self.statusbar.clearMessage()
+        self.MplWidget.canvas.draw_idle()
+        if job.done is not None:
+            job.done(result)
+
+    def grow_line(self, line, data, x_scale):
+        pyramid = self.MplWidget.pyramid(line)
+        pyramid.extend(data)
+        self.MplWidget.replace_decimated(line, data, x_scale, pyramid)
+
+    def on_job_failed(self, job, error):
+        if self.jobs[job.axis] is not job:
+            return
+        self.cancel_job(job.axis)
+        # the last line of the traceback names the exception
+        self.statusbar.clearMessage()
+        QMessageBox.warning(self, "Warning", "{} failed: {}".format(
+            job.name, error.strip().splitlines()[-1]))
 
     # plot original data to both graphs
     def plot_and_update(self):
-        self.MplWidget.canvas.axes[0].plot(np.arange(self.wavFile.getnframes()) /
-                                           self.wavFile.getframerate(), self.timeData)
-        self.MplWidget.canvas.axes[1].plot(self.freqData)
+        if self.timePyramid is None:
+            self.timePyramid = mplwidget.EnvelopePyramid(self.timeData)
+        self.MplWidget.plot_decimated(0, self.timeData, self.x_scale(0), self.timePyramid)
+
+        if self.spectrogram_box.isChecked():
+            self.MplWidget.plot_spectrogram(1, self.timeData, self.reader.framerate, self.stft)
+        else:
+            if self.freqPyramid is None:
+                self.freqPyramid = mplwidget.EnvelopePyramid(self.frequency_data())
+            self.MplWidget.plot_decimated(1, self.frequency_data(), self.x_scale(1),
+                                          self.freqPyramid)
 
         self.MplWidget.canvas.draw()
 
+    # the spectrum of the whole file, only computed once the frequency axis shows it
+    def frequency_data(self):
+        if self.freqData is None:
+            self.freqData = self.spectra.magnitude(self.timeData)
+            self.show_fft_timing()
+        return self.freqData
+
+    # the frequency axis shows either the spectrum of the whole file or a spectrogram,
+    # the spectrum can't be filtered while it isn't shown
+    def on_spectrogram_toggled(self, checked):
+        self.filter_freq_button.setEnabled(not checked)
+        self.reflect_freq_box.setEnabled(not checked)
+        self.reset()
+
+    def on_stft_settings(self):
+        self.stft.configure(self.window_input.value(), self.hop_input.value())
+        if self.MplWidget.spectrogram is not None:
+            self.MplWidget.update_spectrogram()
+            self.MplWidget.canvas.draw_idle()
+
+    # frequency step between spectrum bins, spectra are zero padded to a fast fft length
+    def bin_width(self):
+        return self.spectra.bin_width(len(self.timeData), self.reader.framerate)
+
+    # seconds per sample on the time axis, hertz per bin on the frequency axis
+    def x_scale(self, axis):
+        if axis == 0:
+            return 1 / self.reader.framerate
+        return self.bin_width()
+
+    def show_fft_timing(self):
+        self.statusbar.showMessage(self.spectra.timing_text())
+
     # start over with original data
     def reset(self):
+        self.cancel_jobs()
         self.MplWidget.clear_axes()
         self.MplWidget.init_axes()
 
-        if self.timeData is not None and self.freqData is not None:
+        if self.timeData is not None:
+            # the original spectrum and pyramids are kept, so this doesn't recompute them
             self.plot_and_update()
 
-
-app = QApplication([])
-window = MatplotlibWidget()
-window.show()
-app.exec_()
+    def closeEvent(self, event):
+        # running jobs stop at their next block instead of keeping the app alive
+        self.cancel_jobs()
+        if self.save_job is not None:
+            self.save_job.cancel()
+        QMainWindow.closeEvent(self, event)
+
+
+# filter settings of the batch worker processes, set once by init_batch_worker
+worker_spec = None
+
+
+def init_batch_worker(spec):
+    global worker_spec
+    worker_spec = spec
+
+
+def filter_file(path, out_dir):
+    out_file = os.path.join(out_dir, os.path.basename(path))
+    # the input is memory mapped, it can't be overwritten while it is read
+    if os.path.abspath(out_file) == os.path.abspath(path):
+        raise ValueError("output would overwrite the input")
+    reader = wavio.WavReader(path)
+    method, size, taps, cutoff = worker_spec
+    filter_wav(reader, out_file, create_block_filter(method, size, taps, cutoff, reader.framerate))
+    return out_file
+
+
+def run_batch(paths, out_dir, spec, workers=None, max_in_flight=None):
+    """ Filters every file in paths on a process pool and streams the results to
+    out_dir. At most max_in_flight files are queued at once. Returns the number
+    of failed files. """
+    return batchpool.run_files(filter_file, paths, out_dir, workers, max_in_flight,
+                               init_batch_worker, (spec,))
+
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(
+        description="Filter many wav files without the GUI.")
+    parser.add_argument("inputs", nargs="+", help="wav files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("-f", "--filter", choices=sorted(FILTERS), required=True,
+                        help="filter to apply")
+    parser.add_argument("-k", "--size", type=int, default=5,
+                        help="window size of the median and average filters (default: 5)")
+    parser.add_argument("--taps", type=int, default=6,
+                        help="number of FIR taps (default: 6)")
+    parser.add_argument("--cutoff", type=float, default=0.1,
+                        help="FIR cutoff relative to the nyquist frequency (default: 0.1)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: cpu count)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="maximum number of queued files (default: 2x workers)")
+    args = parser.parse_args(argv)
+
+    if args.size < 1 or args.taps < 1:
+        parser.error("the window size and tap count have to be positive")
+    if not 0 < args.cutoff < 1:
+        parser.error("the cutoff has to be between 0 and 1")
+
+    paths = batchpool.find_files(args.inputs, (".wav",))
+    if not paths:
+        parser.error("no wav files found")
+    os.makedirs(args.output, exist_ok=True)
+
+    spec = (FILTERS[args.filter], args.size, args.taps, args.cutoff)
+    failures = run_batch(paths, args.output, spec, args.workers, args.max_in_flight)
+    print("Filtered {} of {} files.".format(len(paths) - failures, len(paths)))
+    return 1 if failures else 0
+
+
+def main():
+    # any command line arguments run the headless batch mode
+    if len(sys.argv) > 1:
+        sys.exit(batch_main(sys.argv[1:]))
+    app = QApplication([])
+    window = MatplotlibWidget()
+    window.show()
+    app.exec_()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# ------------------------------------------------------
+# -------------------- batchpool.py --------------------
+# ------------------------------------------------------
+""" The headless batch modes of the scripts: expanding the inputs into a list of
+files and running the per file work on a process pool. Only a bounded number of
+files is queued at once, so memory stays flat however many files there are. """
+
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+
+def find_files(inputs, extensions):
+    # expands directories and glob patterns into a sorted list of files
+    paths = list()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        paths.extend(path for path in glob.glob(pattern)
+                     if os.path.splitext(path)[1].lower() in extensions)
+    return sorted(set(paths))
+
+
+def completed(function, arguments, workers=None, max_in_flight=None, initializer=None, initargs=()):
+    """ Calls function(*args) for every args tuple in arguments on a process pool and
+    yields (args, future) in the order they finish. At most max_in_flight calls are
+    queued, arguments is only read as far as that, so it can be a generator. """
+    workers = workers or os.cpu_count()
+    max_in_flight = max_in_flight or 2 * workers
+    with ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs) as pool:
+        pending = dict()
+        for args in arguments:
+            if len(pending) >= max_in_flight:
+                for future in wait(pending, return_when=FIRST_COMPLETED).done:
+                    yield pending.pop(future), future
+            pending[pool.submit(function, *args)] = args
+        for future in list(pending):
+            yield pending.pop(future), future
+
+
+def run_files(function, paths, out_dir, workers=None, max_in_flight=None,
+              initializer=None, initargs=(), progress=print):
+    """ Calls function(path, out_dir) for every path, which returns the file it
+    saved, and reports every finished file. Returns the number of failed files. """
+    failures = 0
+    results = completed(function, ((path, out_dir) for path in paths), workers,
+                        max_in_flight, initializer, initargs)
+    for done_count, ((path, _), future) in enumerate(results, 1):
+        try:
+            out_file = future.result()
+            progress("[{}/{}] saved {}".format(done_count, len(paths), out_file))
+        except Exception as error:
+            failures += 1
+            progress("[{}/{}] failed {}: {}".format(done_count, len(paths), path, error))
+    return failures
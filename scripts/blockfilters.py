@@ -0,0 +1,148 @@
+# ------------------------------------------------------
+# ------------------ blockfilters.py -------------------
+# ------------------------------------------------------
+""" Filters that process a signal block by block and carry their state between
+blocks, so the output equals filtering the whole signal at once. Blocks are
+either 1D or (frames, channels) arrays, all channels are filtered in one call. """
+
+from functools import lru_cache
+
+import numpy as np
+
+import slidingwindow
+
+
+@lru_cache(maxsize=32)
+def design_fir(taps, cutoff, framerate):
+    # lowpass design, cutoff is relative to the nyquist frequency like firwin's default.
+    # Cached so filtering again with the same settings skips the design.
+    from scipy import signal as sp
+    b = sp.firwin(taps, cutoff * framerate / 2, fs=framerate)
+    b.flags.writeable = False
+    return b
+
+
+class FIRBlockFilter:
+    # lfilter with its delay line (zi) carried across blocks. Pure FIR filters
+    # switch to overlap-add FFT convolution when scipy estimates that is faster,
+    # the overlap that carries into the next block is exactly lfilter's zi.
+    def __init__(self, b, a=(1.0,)):
+        self.b = np.asarray(b, dtype=float)
+        self.a = np.asarray(a, dtype=float)
+        self.zi = None
+        self.method = None
+
+    def process(self, block):
+        from scipy import signal as sp
+        block = np.asarray(block, dtype=float)
+        if self.zi is None:
+            self.zi = np.zeros((max(len(self.a), len(self.b)) - 1,) + block.shape[1:])
+        # the taps as a column, so they broadcast over the channels
+        b = self.b.reshape((-1,) + (1,) * (block.ndim - 1))
+        if len(block) and len(self.a) == 1 and self.a[0] == 1.0 and \
+                sp.choose_conv_method(block, b) == "fft":
+            self.method = "overlap-add"
+            full = sp.oaconvolve(block, b, axes=0)
+            full[:len(self.zi)] += self.zi
+            self.zi = full[len(block):]
+            return full[:len(block)]
+        self.method = "lfilter"
+        output, self.zi = sp.lfilter(self.b, self.a, block, axis=0, zi=self.zi)
+        return output
+
+    def flush(self):
+        return np.empty(0)
+
+
+class WindowBlockFilter:
+    # centered window statistic from slidingwindow, the signal is extended with its
+    # edge samples and the output lags the input by k // 2 samples until flush
+    def __init__(self, k, statistic):
+        self.k = slidingwindow.odd(k)
+        self.half = self.k // 2
+        # statistic(x, k) returns the len(x) - k + 1 fully covered windows
+        self.statistic = statistic
+        self.history = None
+
+    def process(self, block):
+        if len(block) == 0:
+            return np.empty((0,) + np.shape(block)[1:])
+        if self.history is None:
+            self.history = np.repeat(np.asarray(block[:1], dtype=float), self.half, axis=0)
+        extended = np.concatenate((self.history, block))
+        self.history = extended[max(len(extended) - 2 * self.half, 0):]
+        return self.statistic(extended, self.k)
+
+    def flush(self):
+        if self.history is None or self.half == 0:
+            return np.empty(0)
+        extended = np.concatenate((self.history, np.repeat(self.history[-1:], self.half, axis=0)))
+        self.history = None
+        return self.statistic(extended, self.k)
+
+
+class MedianBlockFilter(WindowBlockFilter):
+    def __init__(self, k):
+        WindowBlockFilter.__init__(self, k, median_valid)
+
+
+class MovingAverageBlockFilter:
+    # centered mean like slidingwindow.moving_mean, edge windows are divided by the
+    # number of samples they cover. Output lags the input by k // 2 samples until flush.
+    def __init__(self, k):
+        self.k = slidingwindow.odd(k)
+        self.half = self.k // 2
+        self.history = None
+        self.emitted = 0
+        self.total = 0
+
+    def process(self, block):
+        if self.history is None:
+            self.history = np.zeros((self.half,) + np.shape(block)[1:])
+        extended = np.concatenate((self.history, block))
+        self.history = extended[max(len(extended) - 2 * self.half, 0):]
+        self.total += len(block)
+        return self.normalize(extended, False)
+
+    def flush(self):
+        if self.history is None:
+            return np.empty(0)
+        extended = np.concatenate((self.history, np.zeros((self.half,) + self.history.shape[1:])))
+        self.history = None
+        return self.normalize(extended, True)
+
+    def normalize(self, extended, flushing):
+        if len(extended) < self.k:
+            return np.empty(0)
+        sums = slidingwindow.sum_valid(extended, self.k)
+        index = self.emitted + np.arange(len(sums))
+        self.emitted += len(sums)
+        # only the windows emitted by flush can run past the end of the signal
+        right = np.minimum(self.total - 1 - index, self.half) if flushing else self.half
+        counts = np.minimum(index, self.half) + 1 + right
+        return sums / np.reshape(counts, (-1,) + (1,) * (sums.ndim - 1))
+
+
+def median_valid(x, k):
+    return slidingwindow.rank_valid(x, k, k // 2)
+
+
+def filter_blocks(blocks, block_filter):
+    # generator that runs every block through the filter and flushes it at the end
+    for block in blocks:
+        output = block_filter.process(block)
+        if len(output):
+            yield output
+    output = block_filter.flush()
+    if len(output):
+        yield output
+
+
+def array_blocks(data, block_size=2**18):
+    return (data[i:i + block_size] for i in range(0, len(data), block_size))
+
+
+def filter_array(data, block_filter, block_size=2**18):
+    # block-wise filtering of an array that is already (memory mapped) in memory
+    blocks = array_blocks(data, block_size)
+    return np.concatenate(list(filter_blocks(blocks, block_filter)) or [np.empty(0)])
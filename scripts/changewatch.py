@@ -0,0 +1,233 @@
+# ------------------------------------------------------
+# ------------------- changewatch.py -------------------
+# ------------------------------------------------------
+""" Change detection for download folders. A backend is started on a set of
+directories and wait(timeout) returns how much was written to each of them since
+the previous call. On Linux inotify reports the writes as they happen, everywhere
+else the folders are measured again every interval. """
+
+import os
+import sys
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+# inotify event masks, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+# wd, mask, cookie, name length
+EVENT = struct.Struct("iIII")
+
+
+class PollingBackend:
+    """ Measures the directories with measure(directories) once per wait, a write
+    shows up as a size difference between two measurements. """
+
+    # seconds between two measurements
+    interval = 60
+
+    def __init__(self, directories, measure):
+        self.directories = sorted(directories)
+        self.measure = measure
+        self.stopped = threading.Event()
+        self.sizes = measure(self.directories)
+
+    def wait(self, timeout):
+        """ Returns {directory: (writes, bytes written)} of the last timeout seconds,
+        or None when interrupted. """
+        if self.stopped.wait(timeout):
+            return None
+        sizes = self.measure(self.directories)
+        activity = dict()
+        for directory in self.directories:
+            delta = sizes[directory] - self.sizes[directory]
+            activity[directory] = (int(delta != 0), delta)
+        self.sizes = sizes
+        return activity
+
+    # wakes up a waiting thread, wait returns None from then on
+    def interrupt(self):
+        self.stopped.set()
+
+    def close(self):
+        self.interrupt()
+
+
+class InotifyBackend:
+    """ Watches every directory tree with inotify. Writes are counted as they come
+    in, the files they touched are measured once at the end of a wait so a busy
+    download costs one stat per file per wait. Raises OSError when inotify is not
+    available or runs out of watches, the polling backend works everywhere. """
+
+    interval = 1
+
+    def __init__(self, directories):
+        self.directories = sorted(directories)
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # wakes select up when interrupted from another thread
+        self.wake_read, self.wake_write = os.pipe()
+        self.stopped = False
+        self.closed = False
+        # interrupt and close come from different threads, the wake pipe must not
+        # be written after it was closed
+        self.lock = threading.Lock()
+        # watch descriptor -> (root directory, watched directory)
+        self.watches = dict()
+        # file path -> (root directory, last measured size)
+        self.sizes = dict()
+        try:
+            for directory in sorted(directories):
+                self.watch_tree(directory, directory)
+        except OSError:
+            self.close()
+            raise
+
+    def watch_tree(self, root, top, activity=None):
+        for dirpath, _, filenames in os.walk(top):
+            wd = self.add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                # the directory may be gone already, running out of watches is fatal
+                if error in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                raise OSError(error, "inotify_add_watch failed: " + os.strerror(error), dirpath)
+            self.watches[wd] = (root, dirpath)
+            for filename in filenames:
+                self.measure(os.path.join(dirpath, filename), root, activity)
+
+    # stores the new size of a file and adds the difference to activity
+    def measure(self, path, root, activity=None):
+        last = self.sizes.pop(path, (root, 0))[1]
+        try:
+            size = 0 if os.path.islink(path) else os.path.getsize(path)
+            self.sizes[path] = (root, size)
+        except OSError:
+            size = 0
+        if activity is not None:
+            writes, delta = activity[root]
+            activity[root] = (writes, delta + size - last)
+
+    # drops the files of a folder that was moved away
+    def forget_tree(self, root, top, activity):
+        prefix = os.path.join(top, "")
+        for path in [path for path in self.sizes if path.startswith(prefix)]:
+            writes, delta = activity[root]
+            activity[root] = (writes, delta - self.sizes.pop(path)[1])
+
+    def rescan(self, activity):
+        # events were dropped, every watched folder is listed and measured again
+        totals = dict()
+        for root, size in self.sizes.values():
+            totals[root] = totals.get(root, 0) - size
+        self.sizes = dict()
+        watched = {dirpath for _, dirpath in self.watches.values()}
+        for root, dirpath in list(self.watches.values()):
+            try:
+                entries = list(os.scandir(dirpath))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False) and entry.path not in watched:
+                    self.watch_tree(root, entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    self.measure(entry.path, root)
+        for root, size in self.sizes.values():
+            totals[root] = totals.get(root, 0) + size
+        for root, total in totals.items():
+            writes, delta = activity[root]
+            activity[root] = (writes + 1, delta + total)
+
+    def read_events(self, activity, touched):
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 2**10)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT.unpack_from(buffer, offset)
+                name = buffer[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0")
+                offset += EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    self.rescan(activity)
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                if wd not in self.watches or not name:
+                    continue
+                root, dirpath = self.watches[wd]
+                path = os.path.join(dirpath, os.fsdecode(name))
+                writes, delta = activity[root]
+                activity[root] = (writes + 1, delta)
+                if mask & IN_ISDIR:
+                    # new folders are watched, the files in them counted right away
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.watch_tree(root, path, activity)
+                    elif mask & IN_MOVED_FROM:
+                        self.forget_tree(root, path, activity)
+                    continue
+                touched[path] = root
+
+    def wait(self, timeout):
+        """ Returns {directory: (write events, bytes written)} of the last timeout
+        seconds, or None when interrupted. """
+        # every directory is reported, also those that have no watch because they
+        # don't exist (yet), or they would never be seen going idle
+        activity = {directory: (0, 0) for directory in self.directories}
+        touched = dict()
+        # events are read once per wait, the kernel queues them until then, so
+        # a busy download is still measured once per timeout
+        select.select([self.wake_read], [], [], timeout)
+        if self.stopped:
+            return None
+        self.read_events(activity, touched)
+        for path, root in touched.items():
+            self.measure(path, root, activity)
+        return activity
+
+    def interrupt(self):
+        with self.lock:
+            self.stopped = True
+            if not self.closed:
+                os.write(self.wake_write, b"\0")
+
+    def close(self):
+        with self.lock:
+            self.stopped = True
+            if self.closed:
+                return
+            self.closed = True
+            for fd in (self.fd, self.wake_read, self.wake_write):
+                os.close(fd)
+
+
+def create_backend(directories, measure):
+    """ The inotify backend on Linux, or the polling backend when inotify can't be
+    used. measure(directories) returns {directory: progress in bytes}. """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyBackend(directories)
+        except (OSError, AttributeError):
+            pass
+    return PollingBackend(directories, measure)
@@ -0,0 +1,108 @@
+# ------------------------------------------------------
+# -------------------- folderscan.py -------------------
+# ------------------------------------------------------
+""" Folder sizes for watchers that measure the same trees over and over. The
+listing of every directory is cached until the directory's mtime changes, so a
+rescan of an unchanged tree skips reading the directories and only stats the
+files, and folders on different drives are scanned at the same time. """
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# listings of directories changed this recently are not cached, a file added in
+# the same timestamp tick as the scan would not change the mtime again
+RACY_TIME_NS = 2 * 10**9
+
+
+class FolderScanner:
+    """ Sums the sizes of the regular files in directory trees, symlinks are not
+    followed. File sizes are read again on every scan, a file that grows doesn't
+    touch the mtime of its directory. """
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        # directory -> (mtime in ns, file paths, subdirectory paths)
+        self.listings = dict()
+        # sizes() scans drives on several threads that share the listings, this
+        # guards changing them and iterating over them
+        self.lock = threading.Lock()
+
+    def list_directory(self, path, mtime):
+        files = list()
+        directories = list()
+        total = 0
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        # free on windows, one stat elsewhere
+                        total += entry.stat(follow_symlinks=False).st_size
+                        files.append(entry.path)
+                except OSError:
+                    # removed while scanning
+                    continue
+        if time.time_ns() - mtime > RACY_TIME_NS:
+            with self.lock:
+                self.listings[path] = (mtime, files, directories)
+        return total, directories
+
+    def size(self, top):
+        total = 0
+        scanned = set()
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            try:
+                # read before listing, a change during the listing shows up next scan
+                mtime = os.stat(path).st_mtime_ns
+                cached = self.listings.get(path)
+                if cached is not None and cached[0] == mtime:
+                    _, files, directories = cached
+                    for filepath in files:
+                        try:
+                            total += os.stat(filepath, follow_symlinks=False).st_size
+                        except OSError:
+                            continue
+                else:
+                    size, directories = self.list_directory(path, mtime)
+                    total += size
+            except OSError:
+                continue
+            scanned.add(path)
+            stack.extend(directories)
+
+        # forget the listings of directories that are gone
+        prefix = os.path.join(top, "")
+        with self.lock:
+            for path in [path for path in self.listings if path.startswith(prefix)]:
+                if path not in scanned:
+                    del self.listings[path]
+        return total
+
+    def drive(self, path):
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            return path
+
+    def sizes(self, directories):
+        """ Returns {directory: size in bytes}. Directories on the same drive are
+        scanned one after the other, drives in parallel. """
+        drives = dict()
+        for directory in directories:
+            drives.setdefault(self.drive(directory), list()).append(directory)
+        groups = list(drives.values())
+        if len(groups) <= 1:
+            return {directory: self.size(directory) for directory in directories}
+        with ThreadPoolExecutor(self.workers or len(groups)) as executor:
+            results = executor.map(
+                lambda group: [(directory, self.size(directory)) for directory in group], groups)
+            return dict(pair for group in results for pair in group)
+
+    def clear(self):
+        with self.lock:
+            self.listings.clear()
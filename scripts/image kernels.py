@@ -1,11 +1,31 @@
 """ This module forms an application that can load and save images and apply kernel filters to it"""
 
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import tkinter as tk
 import tkinter.filedialog
 import tkinter.messagebox
-import cv2
 import numpy as np
-from PIL import Image, ImageTk
+
+import batchpool
+# cv2, PIL and scipy are imported by the functions that use them, they take most of
+# the startup time and aren't needed to show the window or to parse arguments
+_cv2 = None
+
+
+def opencv():
+    # imports cv2 on first use, later calls only read the global
+    global _cv2
+    if _cv2 is None:
+        import cv2
+        _cv2 = cv2
+    return _cv2
 
 
 class Action:
@@ -14,6 +34,750 @@ class Action:
         self.name = name
 
 
+class SnapshotCache:
+    """ Memory bounded cache of intermediate results. A snapshot is keyed by the
+    number of actions that were applied to the original image to produce it. """
+
+    def __init__(self, budget=512 * 1024 * 1024):
+        self.budget = budget
+        self.snapshots = OrderedDict()
+        self.bytes_held = 0
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, step, image):
+        if step in self.snapshots:
+            self.remove(step)
+        # a single snapshot that doesn't fit would flush the whole cache
+        if image.nbytes > self.budget:
+            return
+        # evict the least recently used snapshots until the new one fits
+        while self.bytes_held + image.nbytes > self.budget:
+            _, evicted = self.snapshots.popitem(last=False)
+            self.bytes_held -= evicted.nbytes
+        # snapshots are shared with the application, make sure nobody writes to them
+        image.flags.writeable = False
+        self.snapshots[step] = image
+        self.bytes_held += image.nbytes
+
+    def get(self, step):
+        image = self.snapshots.get(step)
+        if image is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.snapshots.move_to_end(step)
+        return image
+
+    def nearest(self, step):
+        # returns the closest snapshot at or before step as (step, image)
+        candidates = [key for key in self.snapshots if key <= step]
+        if not candidates:
+            self.misses += 1
+            return 0, None
+        best = max(candidates)
+        return best, self.get(best)
+
+    def remove(self, step):
+        image = self.snapshots.pop(step)
+        self.bytes_held -= image.nbytes
+
+    def invalidate(self, step):
+        # drops every snapshot that was built on top of action index step
+        for key in [key for key in self.snapshots if key > step]:
+            self.remove(key)
+
+    def clear(self):
+        self.snapshots.clear()
+        self.bytes_held = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "bytes_held": self.bytes_held, "snapshots": len(self.snapshots)}
+
+
+# rough per pixel cost estimates used to pick an execution method for a stage
+FFT_COST_FACTOR = 4.0
+FFT_COST_OFFSET = 16.0
+
+
+class Stage:
+    """ A single execution step of a compiled kernel chain, covering the actions
+    from index start up to (but not including) stop. """
+
+    def __init__(self, kernel, start, stop, names):
+        self.kernel = kernel
+        self.start = start
+        self.stop = stop
+        self.names = names
+        self.method = "direct"
+        self.in_range = stays_in_range(kernel)
+        self.cost = 0
+        self.column = None
+        self.row = None
+
+    def choose_method(self, image_shape):
+        costs = {"direct": direct_cost(self.kernel),
+                 "fft": fft_cost(self.kernel, image_shape)}
+        separated = separate_kernel(self.kernel)
+        if separated is not None:
+            self.column, self.row = separated
+            costs["separable"] = self.kernel.shape[0] + self.kernel.shape[1]
+        self.method = min(costs, key=costs.get)
+        self.cost = costs[self.method]
+        return self.cost
+
+    def apply(self, source, target):
+        cv2 = opencv()
+        # filters the float32 source buffer into the float32 target buffer
+        if self.method == "separable":
+            cv2.sepFilter2D(source, cv2.CV_32F, self.row, self.column, dst=target)
+        elif self.method == "fft":
+            target[...] = fft_correlate(source, self.kernel)
+        else:
+            cv2.filter2D(source, cv2.CV_32F, self.kernel, dst=target)
+
+
+class FloatPipeline:
+    """ Runs chain plans in a pair of preallocated float32 ping-pong buffers. Every
+    stage reads one buffer and writes the other, results are only converted back
+    to uint8 when they leave the pipeline. Buffers grow but are never shrunk, so
+    a pipeline can be reused for tiles and frames of different sizes. """
+
+    def __init__(self):
+        self.storage = (np.empty(0, np.float32), np.empty(0, np.float32))
+
+    def buffers(self, shape):
+        size = int(np.prod(shape))
+        if self.storage[0].size < size:
+            self.storage = (np.empty(size, np.float32), np.empty(size, np.float32))
+        return [storage[:size].reshape(shape) for storage in self.storage]
+
+    def run(self, plan, image, clamp=True):
+        """ Yields (stage, buffer) after every stage. The buffer is overwritten by
+        the next stage, so convert it with to_uint8 if it has to be kept. With clamp
+        the uint8 rounding and saturation is applied after every stage, which makes
+        direct and separable stages identical to filtering in uint8. FFT stages can
+        land one level off on pixels whose exact value is close to a rounding
+        boundary, filter2D transforms large kernels in float32 itself, so neither
+        result is exact there. """
+        front, back = self.buffers(image.shape)
+        np.copyto(front, image, casting="unsafe")
+        for stage in plan.stages:
+            stage.apply(front, back)
+            if clamp:
+                saturate(back, stage.in_range)
+            front, back = back, front
+            yield stage, front
+
+    def execute(self, plan, image, clamp=True, out=None):
+        buffer = None
+        for _, buffer in self.run(plan, image, clamp):
+            pass
+        if buffer is None:
+            return image
+        if not clamp:
+            saturate(buffer)
+        return to_uint8(buffer, out)
+
+
+def saturate(buffer, in_range=False):
+    # the float32 equivalent of cv2's saturate_cast to uint8, in place. Clipping
+    # is skipped when the stage is known to keep values inside [0, 255].
+    np.rint(buffer, out=buffer)
+    if not in_range:
+        np.clip(buffer, 0, 255, out=buffer)
+
+
+def to_uint8(buffer, out=None):
+    # expects a saturated buffer
+    if out is None:
+        out = np.empty(buffer.shape, np.uint8)
+    np.copyto(out, buffer, casting="unsafe")
+    return out
+
+
+# every thread gets its own pipeline, so thread pools can share a plan
+thread_state = threading.local()
+
+
+def get_pipeline():
+    if not hasattr(thread_state, "pipeline"):
+        thread_state.pipeline = FloatPipeline()
+    return thread_state.pipeline
+
+
+class ChainPlan:
+    """ The execution plan for a list of actions, as produced by compile_chain. """
+
+    def __init__(self, stages, notes, clamp=True):
+        self.stages = stages
+        self.notes = notes
+        self.clamp = clamp
+
+    def run(self, image):
+        # yields the intermediate uint8 result after every stage
+        for stage, buffer in get_pipeline().run(self, image, self.clamp):
+            if not self.clamp:
+                buffer = buffer.copy()
+                saturate(buffer)
+            yield stage, to_uint8(buffer)
+
+    def execute(self, image, out=None):
+        return get_pipeline().execute(self, image, self.clamp, out)
+
+    # first is the index of the first action the plan was compiled from
+    def report(self, first=0):
+        lines = list()
+        for stage in self.stages:
+            rows, cols = stage.kernel.shape
+            lines.append("actions {}-{}: {} {}x{} ({})".format(
+                first + stage.start, first + stage.stop - 1, stage.method, rows, cols, ", ".join(stage.names)))
+        lines.extend("note: " + note for note in self.notes)
+        return "\n".join(lines)
+
+
+def direct_cost(kernel):
+    return kernel.shape[0] * kernel.shape[1]
+
+
+def fft_cost(kernel, image_shape):
+    # forward and inverse transform of the padded image, spread out per pixel
+    area = (image_shape[0] + kernel.shape[0]) * (image_shape[1] + kernel.shape[1])
+    return FFT_COST_FACTOR * np.log2(area) + FFT_COST_OFFSET
+
+
+def separate_kernel(kernel, tolerance=1e-6):
+    # a rank 1 kernel is the outer product of a column and a row vector
+    if min(kernel.shape) < 2:
+        return None
+    u, s, vt = np.linalg.svd(kernel.astype(np.float64))
+    if s[0] == 0 or s[1] > tolerance * s[0]:
+        return None
+    scale = np.sqrt(s[0])
+    column = (u[:, 0] * scale).astype(np.float32)
+    row = (vt[0] * scale).astype(np.float32)
+    return column, row
+
+
+def fuse_kernels(first, second):
+    # correlating with first and then second equals correlating with their full convolution
+    rows, cols = first.shape[0] + second.shape[0] - 1, first.shape[1] + second.shape[1] - 1
+    fused = np.zeros((rows, cols), np.float64)
+    for y in range(second.shape[0]):
+        for x in range(second.shape[1]):
+            fused[y:y + first.shape[0], x:x + first.shape[1]] += second[y, x] * first
+    return fused.astype(np.float32)
+
+
+def fft_correlate(image, kernel):
+    cv2 = opencv()
+    from scipy.signal import fftconvolve
+    rows, cols = kernel.shape
+    # pad the same way filter2D does, so the result only differs by float rounding
+    padded = cv2.copyMakeBorder(image, rows // 2, rows - 1 - rows // 2,
+                                cols // 2, cols - 1 - cols // 2, cv2.BORDER_REFLECT_101)
+    flipped = kernel[::-1, ::-1]
+    if padded.ndim == 3:
+        flipped = flipped[:, :, np.newaxis]
+    return fftconvolve(padded, flipped, mode="valid", axes=(0, 1))
+
+
+def is_odd(kernel):
+    return kernel.shape[0] % 2 == 1 and kernel.shape[1] % 2 == 1
+
+
+def stays_in_range(kernel):
+    # non negative kernels that sum to one can't push a pixel out of [0, 255]
+    return kernel.min() >= 0 and abs(kernel.sum() - 1) < 1e-4
+
+
+def compile_chain(actions, image_shape=(1024, 1024), fuse=False, clamp=True):
+    """ Turns a list of actions into a ChainPlan, picking the cheapest of direct,
+    separable and FFT filtering for every stage. With fuse enabled consecutive
+    kernels are merged into one when that is estimated to be cheaper. Without
+    clamp intermediate results keep their float precision instead of being
+    rounded and saturated to uint8 after every stage. """
+    stages = list()
+    notes = list()
+    for index, action in enumerate(actions):
+        stage = Stage(action.kernel, index, index + 1, [action.name])
+        stage.choose_method(image_shape)
+        if fuse and stages and is_odd(stages[-1].kernel) and is_odd(stage.kernel):
+            previous = stages[-1]
+            merged = Stage(fuse_kernels(previous.kernel, stage.kernel),
+                           previous.start, stage.stop, previous.names + stage.names)
+            if merged.choose_method(image_shape) <= previous.cost + stage.cost:
+                stages[-1] = merged
+                continue
+        stages.append(stage)
+
+    for stage in stages:
+        if stage.stop - stage.start < 2:
+            continue
+        names = ", ".join(stage.names)
+        kernels = [action.kernel for action in actions[stage.start:stage.stop - 1]]
+        if all(stays_in_range(kernel) for kernel in kernels):
+            notes.append("fusing {} skips the uint8 rounding between steps, "
+                         "pixels may differ by a few levels".format(names))
+        else:
+            notes.append("fusing {} skips the uint8 clamping between steps, "
+                         "intermediate values outside [0, 255] are no longer cut off "
+                         "so results can differ significantly".format(names))
+        notes.append("fusing {} reflects the image border once instead of per step, "
+                     "pixels near the border may differ".format(names))
+    if not clamp:
+        notes.append("values are not rounded or clamped to uint8 between stages")
+    return ChainPlan(stages, notes, clamp)
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+# formats that can be memory mapped for tiled processing
+TILED_EXTENSIONS = (".raw", ".tif", ".tiff")
+
+
+def string_to_kernel(text):
+    kernel = text.replace(" ", "").split(")(")
+    # removes the starting '(' and ending ')'
+    kernel[0], kernel[-1] = kernel[0][1:], kernel[-1][:-1]
+    # converts the row strings to integer lists
+    kernel = [[float(number) for number in row.split(',')] for row in kernel]
+    # create the kernel as numpy array and divide it by the kernel's sum
+    # the if statement is so we don't accidentally divide by 0
+    if sum(map(sum, kernel)):
+        kernel = np.array(kernel, np.float32) / sum(map(sum, kernel))
+    else:
+        kernel = np.array(kernel, np.float32)
+    return kernel
+
+
+def load_image(path):
+    cv2 = opencv()
+    image = cv2.imread(path)
+    if image is None:
+        raise OSError("Unable to read image file: {}".format(path))
+    # swap the channels in place instead of splitting and merging copies
+    cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+    return image
+
+
+def write_image(path, image):
+    cv2 = opencv()
+    if not cv2.imwrite(path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR)):
+        raise OSError("Unable to write image file: {}".format(path))
+
+
+def load_chain(path):
+    # a chain file holds one kernel string per line, '#' starts a comment
+    actions = list()
+    with open(path) as file:
+        for line in file:
+            text = line.split("#")[0].strip()
+            if text:
+                actions.append(Action(string_to_kernel(text), text))
+    return actions
+
+
+def save_chain(path, actions):
+    with open(path, "w") as file:
+        for action in actions:
+            file.write(action.name + "\n")
+
+
+def open_memmap(path, shape=None, dtype=np.uint8):
+    # raw files need their shape passed in, tiff files carry it in their header
+    if os.path.splitext(path)[1].lower() == ".raw":
+        if shape is None:
+            raise ValueError("The shape of a raw image has to be specified.")
+        return np.memmap(path, dtype=dtype, mode="r", shape=tuple(shape))
+    try:
+        import tifffile
+    except ImportError:
+        raise ImportError("Memory mapping tiff files requires the tifffile package.")
+    return tifffile.memmap(path, mode="r")
+
+
+def create_memmap(path, shape, dtype=np.uint8):
+    if os.path.splitext(path)[1].lower() == ".raw":
+        return np.memmap(path, dtype=dtype, mode="w+", shape=tuple(shape))
+    try:
+        import tifffile
+    except ImportError:
+        raise ImportError("Memory mapping tiff files requires the tifffile package.")
+    return tifffile.memmap(path, shape=tuple(shape), dtype=dtype)
+
+
+def check_uint8(image):
+    # the pipeline saturates to [0, 255], wider samples like 16 bit scans would wrap
+    if image.dtype != np.uint8:
+        raise ValueError("Only 8 bit images can be filtered, this one has {} samples.".format(
+            image.dtype))
+
+
+def chain_radius(actions):
+    # the number of pixels on each side (top, bottom, left, right) that
+    # influence an output pixel after running the whole chain
+    top = bottom = left = right = 0
+    for action in actions:
+        rows, cols = action.kernel.shape
+        top += rows // 2
+        bottom += rows - 1 - rows // 2
+        left += cols // 2
+        right += cols - 1 - cols // 2
+    return top, bottom, left, right
+
+
+def filter_tile(source, target, plan, bounds, halo):
+    y0, y1, x0, x1 = bounds
+    top, bottom, left, right = halo
+    height, width = source.shape[:2]
+    # read the tile plus a halo, clipped to the image so the image border
+    # gets the same reflection filter2D applies to the whole image
+    ry0, ry1 = max(y0 - top, 0), min(y1 + bottom, height)
+    rx0, rx1 = max(x0 - left, 0), min(x1 + right, width)
+    region = np.ascontiguousarray(source[ry0:ry1, rx0:rx1])
+    result = plan.execute(region)
+    target[y0:y1, x0:x1] = result[y0 - ry0:y1 - ry0, x0 - rx0:x1 - rx0]
+
+
+def filter_tiled(source, target, actions, tile_size=1024, workers=None, fuse=False, clamp=True,
+                 report=None):
+    """ Runs the action chain over a (memory mapped) source image tile by tile and
+    writes into target. Tiles are read with a halo as wide as the chain's total
+    radius, so the output matches filtering the whole image at once while peak
+    memory only depends on the tile size. report is called with the plan before
+    the first tile is filtered. Raises ValueError when source isn't uint8. """
+    check_uint8(source)
+    workers = workers or os.cpu_count()
+    halo = chain_radius(actions)
+    tile_shape = (tile_size + halo[0] + halo[1], tile_size + halo[2] + halo[3]) + source.shape[2:]
+    plan = compile_chain(actions, tile_shape, fuse, clamp)
+    if report is not None:
+        report(plan)
+    height, width = source.shape[:2]
+    tiles = [(y, min(y + tile_size, height), x, min(x + tile_size, width))
+             for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+
+    # cv2 releases the GIL, so threads filter tiles in parallel without copying them
+    # between processes. Bound the queue so only a few tiles are in memory at once.
+    with ThreadPoolExecutor(workers) as pool:
+        pending = set()
+        for bounds in tiles:
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(pool.submit(filter_tile, source, target, plan, bounds, halo))
+        for future in pending:
+            future.result()
+    if isinstance(target, np.memmap):
+        target.flush()
+
+
+# state of a batch worker process, set once by init_batch_worker
+worker_actions = None
+worker_fuse = False
+worker_clamp = True
+
+
+def init_batch_worker(kernel_strings, fuse, clamp):
+    global worker_actions, worker_fuse, worker_clamp
+    worker_actions = [Action(string_to_kernel(text), text) for text in kernel_strings]
+    worker_fuse = fuse
+    worker_clamp = clamp
+
+
+def filter_file(path, out_dir):
+    image = load_image(path)
+    plan = compile_chain(worker_actions, image.shape, worker_fuse, worker_clamp)
+    out_file = os.path.join(out_dir, os.path.basename(path))
+    write_image(out_file, plan.execute(image))
+    return out_file
+
+
+def print_plan(plan):
+    # fusing changes results, so the plan and where it differs are shown up front
+    print(plan.report(), flush=True)
+
+
+def run_batch(paths, out_dir, kernel_strings, workers=None, max_in_flight=None,
+              fuse=False, clamp=True):
+    """ Filters every image in paths with the kernel chain on a process pool and
+    writes the results to out_dir. At most max_in_flight images are queued at
+    once so memory stays bounded. Returns the number of failed images. """
+    return batchpool.run_files(filter_file, paths, out_dir, workers, max_in_flight,
+                               init_batch_worker, (kernel_strings, fuse, clamp))
+
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(
+        description="Apply a kernel chain to many images without the GUI.")
+    parser.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    chain = parser.add_mutually_exclusive_group(required=True)
+    chain.add_argument("-k", "--kernel", action="append",
+                       help="kernel string like \"(1,1,1) (1,1,1) (1,1,1)\", can be repeated")
+    chain.add_argument("-c", "--chain", help="chain file with one kernel string per line")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: cpu count)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="maximum number of queued images (default: 2x workers)")
+    parser.add_argument("--fuse", action="store_true",
+                        help="fuse consecutive kernels, results may differ slightly")
+    parser.add_argument("--no-clamp", action="store_true",
+                        help="keep float precision between kernels instead of rounding to uint8")
+    parser.add_argument("--tile-size", type=int, default=None,
+                        help="process memory mapped .raw/.tif images in tiles of this size")
+    parser.add_argument("--shape", type=int, nargs="+", metavar="N",
+                        help="shape of .raw inputs as HEIGHT WIDTH [CHANNELS]")
+    parser.add_argument("--video", action="store_true",
+                        help="inputs are video files or frame sequences like frames/%%04d.png")
+    parser.add_argument("--fourcc", default="mp4v", help="codec of video outputs (default: mp4v)")
+    args = parser.parse_args(argv)
+
+    # parse the chain up front so syntax errors don't surface in every worker
+    try:
+        if args.chain:
+            kernel_strings = [action.name for action in load_chain(args.chain)]
+        else:
+            kernel_strings = args.kernel
+            for text in kernel_strings:
+                string_to_kernel(text)
+    except (OSError, ValueError, IndexError) as error:
+        parser.error("unable to parse kernel chain: {}".format(error))
+
+    if args.video:
+        os.makedirs(args.output, exist_ok=True)
+        return video_main(args.inputs, args.output, kernel_strings, args)
+
+    paths = batchpool.find_files(args.inputs, TILED_EXTENSIONS if args.tile_size else IMAGE_EXTENSIONS)
+    if not paths:
+        parser.error("no images found")
+    os.makedirs(args.output, exist_ok=True)
+
+    if args.tile_size:
+        return tiled_main(paths, args.output, kernel_strings, args)
+
+    if args.fuse:
+        # the workers plan every image for its own size, this is the plan of the first
+        actions = [Action(string_to_kernel(text), text) for text in kernel_strings]
+        try:
+            shape = load_image(paths[0]).shape
+        except OSError:
+            shape = (1024, 1024, 3)
+        print_plan(compile_chain(actions, shape, args.fuse, not args.no_clamp))
+    failures = run_batch(paths, args.output, kernel_strings,
+                         args.workers, args.max_in_flight, args.fuse, not args.no_clamp)
+    print("Filtered {} of {} images.".format(len(paths) - failures, len(paths)))
+    return 1 if failures else 0
+
+
+def threaded(generator, maxsize):
+    """ Runs a generator on its own thread and yields its items through a bounded
+    queue, so the producer never runs more than maxsize items ahead. When the
+    consumer stops early the producer is stopped and its generator closed. """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+    done = object()
+
+    # returns False once the consumer is gone
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in generator:
+                if not put(item):
+                    return
+        except Exception as error:
+            put(error)
+            return
+        finally:
+            # releases what the generator holds, like an open capture
+            if hasattr(generator, "close"):
+                generator.close()
+        put(done)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # a full queue would keep the producer waiting in put
+        while True:
+            try:
+                items.get_nowait()
+            except queue.Empty:
+                break
+        producer.join()
+
+
+def read_frames(source):
+    cv2 = opencv()
+    # cv2 reads both video files and numbered sequences like "frames/%04d.png"
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise OSError("Unable to open video: {}".format(source))
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            yield frame
+    finally:
+        capture.release()
+
+
+def filter_frames(frames, actions, workers, fuse=False, clamp=True, report=None):
+    # filters frames on a thread pool while keeping them in order
+    plan = None
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+        for frame in frames:
+            if plan is None:
+                plan = compile_chain(actions, frame.shape, fuse, clamp)
+                if report is not None:
+                    report(plan)
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+            pending.append(pool.submit(plan.execute, frame))
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_frames(frames, target, fps, fourcc="mp4v", report_every=100):
+    cv2 = opencv()
+    # writes to a video file, or to numbered images when target contains a '%' pattern
+    writer = None
+    count = 0
+    start = time.perf_counter()
+    try:
+        for frame in frames:
+            if "%" in target:
+                if not cv2.imwrite(target % count, frame):
+                    raise OSError("Unable to write image file: {}".format(target % count))
+            else:
+                if writer is None:
+                    size = (frame.shape[1], frame.shape[0])
+                    writer = cv2.VideoWriter(target, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+                    if not writer.isOpened():
+                        raise OSError("Unable to write video: {}".format(target))
+                writer.write(frame)
+            count += 1
+            if count % report_every == 0:
+                print("{} frames, {:.1f} frames/sec".format(
+                    count, count / (time.perf_counter() - start)))
+    finally:
+        if writer is not None:
+            writer.release()
+    return count, time.perf_counter() - start
+
+
+def filter_video(source, target, actions, workers=None, queue_size=8,
+                 fuse=False, clamp=True, fourcc="mp4v", report=None):
+    """ Streams a video or frame sequence through decode, filter and encode stages
+    that run on separate threads and are connected by bounded queues, so only a
+    handful of frames are ever held in memory. report is called with the plan
+    once the first frame is decoded. Returns (frames, seconds). """
+    cv2 = opencv()
+    workers = workers or os.cpu_count()
+    capture = cv2.VideoCapture(source)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    capture.release()
+
+    decoded = threaded(read_frames(source), queue_size)
+    filtered = threaded(filter_frames(decoded, actions, workers, fuse, clamp, report), queue_size)
+    try:
+        return write_frames(filtered, target, fps, fourcc)
+    finally:
+        # a failed writer stops the decode and filter threads instead of leaking them
+        filtered.close()
+        decoded.close()
+
+
+def video_main(sources, out_dir, kernel_strings, args):
+    actions = [Action(string_to_kernel(text), text) for text in kernel_strings]
+    failures = 0
+    for index, source in enumerate(sources):
+        target = os.path.join(out_dir, os.path.basename(source))
+        try:
+            frames, seconds = filter_video(source, target, actions, args.workers,
+                                           fuse=args.fuse, clamp=not args.no_clamp,
+                                           fourcc=args.fourcc,
+                                           report=print_plan if args.fuse and index == 0 else None)
+            print("[{}/{}] saved {} ({} frames, {:.1f} frames/sec)".format(
+                index + 1, len(sources), target, frames, frames / max(seconds, 1e-9)))
+        except Exception as error:
+            failures += 1
+            print("[{}/{}] failed {}: {}".format(index + 1, len(sources), source, error))
+    return 1 if failures else 0
+
+
+# size of the label the image is shown in
+DISPLAY_SIZE = (700, 700)
+
+
+def scale_kernel(kernel, scale_y, scale_x):
+    """ Approximates a full resolution kernel on an image scaled down by scale_y and
+    scale_x. Kernels keep at least a 3x3 footprint and their sum, so flat areas
+    and the general character of the filter stay the same in the preview. """
+    cv2 = opencv()
+    rows, cols = kernel.shape
+    new_rows = max(int(rows * scale_y) // 2 * 2 + 1, min(rows, 3))
+    new_cols = max(int(cols * scale_x) // 2 * 2 + 1, min(cols, 3))
+    if new_rows >= rows and new_cols >= cols:
+        return kernel
+    scaled = cv2.resize(kernel, (new_cols, new_rows), interpolation=cv2.INTER_AREA)
+    if abs(kernel.sum()) > 1e-6:
+        return (scaled * (kernel.sum() / scaled.sum())).astype(np.float32)
+    return (scaled * (np.abs(kernel).sum() / np.abs(scaled).sum())).astype(np.float32)
+
+
+def make_proxy(image):
+    cv2 = opencv()
+    # downscale to the display size, keeping the aspect ratio
+    height, width = image.shape[:2]
+    factor = min(DISPLAY_SIZE[0] / width, DISPLAY_SIZE[1] / height, 1.0)
+    size = (max(int(width * factor), 1), max(int(height * factor), 1))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def tiled_main(paths, out_dir, kernel_strings, args):
+    # huge images are processed one at a time, with the parallelism inside the image
+    actions = [Action(string_to_kernel(text), text) for text in kernel_strings]
+    failures = 0
+    for index, path in enumerate(paths):
+        out_file = os.path.join(out_dir, os.path.basename(path))
+        try:
+            source = open_memmap(path, args.shape)
+            # checked before the output file is created
+            check_uint8(source)
+            target = create_memmap(out_file, source.shape, np.uint8)
+            filter_tiled(source, target, actions, args.tile_size, args.workers,
+                         args.fuse, not args.no_clamp,
+                         print_plan if args.fuse and index == 0 else None)
+            del target
+            print("[{}/{}] saved {}".format(index + 1, len(paths), out_file))
+        except Exception as error:
+            failures += 1
+            print("[{}/{}] failed {}: {}".format(index + 1, len(paths), path, error))
+    print("Filtered {} of {} images.".format(len(paths) - failures, len(paths)))
+    return 1 if failures else 0
+
+
 class Application:
     def __init__(self):
         self.window = tk.Tk()
@@ -21,8 +785,10 @@ class Application:
         self.window.geometry("900x800")
         self.window.resizable(False, False)
 
-        self.window.config(menu=self.init_menu())
         self.actions = list()
+        self.cache = SnapshotCache()
+        self.fuse_kernels = tk.BooleanVar(self.window, value=False)
+        self.window.config(menu=self.init_menu())
 
         self.imageframe = tk.Frame(self.window)
         self.imageframe.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
@@ -40,12 +806,19 @@ class Application:
         self.inputframe = tk.Frame(self.imageframe)
         self.inputframe.pack(fill=tk.BOTH, expand=True)
 
+        # the plan of the last render while kernels are fused, with where fusing
+        # changes the result
+        self.plan_label = tk.Label(self.imageframe, justify=tk.LEFT, anchor=tk.W,
+                                   wraplength=DISPLAY_SIZE[0])
+        self.plan_label.pack(fill=tk.X)
+
         # gui buttons
-        self.submit_btn = tk.Button(self.inputframe, text="Submit",
+        # enabled by load_startup_image, there is nothing to filter before that
+        self.submit_btn = tk.Button(self.inputframe, text="Submit", state=tk.DISABLED,
                                     command=self.submit, padx=2, pady=2)
         self.submit_btn.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
 
-        self.reset_btn = tk.Button(self.inputframe, text="Reset",
+        self.reset_btn = tk.Button(self.inputframe, text="Reset", state=tk.DISABLED,
                                    command=self.reset, padx=2, pady=2)
         self.reset_btn.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
 
@@ -60,16 +833,41 @@ class Application:
                                     command=self.del_action, padx=2, pady=2)
         self.del_button.pack(fill=tk.BOTH, expand=True)
 
-        # load image
-        self.main_img = self.load_image("lena.jpg")
-        self.original = self.main_img.copy()
+        # full resolution renders run on a worker thread and report back through
+        # this queue, a newer render bumps the generation which cancels older ones
+        self.render_queue = queue.Queue()
+        # the worker lives as long as the window, so its pipeline's float buffers
+        # are allocated once instead of for every render
+        self.render_requests = queue.Queue()
+        threading.Thread(target=self.render_worker, daemon=True).start()
+        self.generation = 0
+        # generation of the render main_img holds, saving waits until it is current
+        self.committed = 0
+
+        # the image is loaded once the window is up, so the window doesn't wait on cv2
+        self.main_img = None
+        self.original = None
+        self.proxy_original = None
+        self.proxy_img = None
 
         self.tkpi = None
+        self.window.after(1, self.load_startup_image)
+        self.window.after(50, self.poll_render)
+
+    def load_startup_image(self):
+        self.main_img = load_image("lena.jpg")
+        self.original = self.main_img.copy()
+        self.proxy_original = make_proxy(self.original)
+        self.proxy_img = self.proxy_original
         self.display(self.main_img)
+        self.submit_btn.config(state=tk.NORMAL)
+        self.reset_btn.config(state=tk.NORMAL)
 
     # updates the image to display
     def display(self, cv_img):
-        thumbnail = cv2.resize(cv_img, (700,700))
+        cv2 = opencv()
+        from PIL import Image, ImageTk
+        thumbnail = cv2.resize(cv_img, DISPLAY_SIZE)
         image = Image.fromarray(thumbnail)
         self.tkpi = ImageTk.PhotoImage(image=image)
         self.label_image.configure(image=self.tkpi)
@@ -79,6 +877,9 @@ class Application:
         filemenu = tk.Menu(menubar, tearoff=0)
         filemenu.add_command(label="Open image", command=self.open_image)
         filemenu.add_command(label="Save image", command=self.save_image)
+        filemenu.add_separator()
+        filemenu.add_command(label="Open chain", command=self.open_chain)
+        filemenu.add_command(label="Save chain", command=self.save_chain)
         menubar.add_cascade(label="File", menu=filemenu)
 
         # add pre defined edge detection filters
@@ -104,6 +905,10 @@ class Application:
         def unsharp_mask(): return self.do_filter("(1, 4, 6, 4, 1) (4, 16, 24, 16, 4) (6, 24, -476, 24, 6) (4, 16, 24, 16, 4) (1, 4, 6, 4, 1)")
         filtermenu.add_command(label="Unsharp mask", command=unsharp_mask)
         menubar.add_cascade(label="Filter", menu=filtermenu)
+
+        optionmenu = tk.Menu(menubar, tearoff=0)
+        optionmenu.add_checkbutton(label="Fuse kernels on replay", variable=self.fuse_kernels)
+        menubar.add_cascade(label="Options", menu=optionmenu)
         # return the constructed menu bar
         return menubar
 
@@ -113,71 +918,149 @@ class Application:
         self.submit()
 
     def save_image(self):
+        if self.main_img is None:
+            return
+        if self.committed != self.generation:
+            tk.messagebox.showwarning("Warning", "Still rendering, please wait.")
+            return
         path = tk.filedialog.asksaveasfilename(defaultextension=".png")
         if not path:
             return
-        b, g, r = cv2.split(self.main_img)
-        output = cv2.merge((r, g, b))
-        cv2.imwrite(path, output)
+        write_image(path, self.main_img)
 
-    def load_image(self, path):
-        image = cv2.imread(path)
-        b, g, r = cv2.split(image)
-        image = cv2.merge((r, g, b))
-        return image
+    def save_chain(self):
+        path = tk.filedialog.asksaveasfilename(defaultextension=".txt")
+        if not path:
+            return
+        save_chain(path, self.actions)
+
+    def open_chain(self):
+        if self.original is None:
+            return
+        path = tk.filedialog.askopenfilename()
+        if not path:
+            return
+        try:
+            actions = load_chain(path)
+        except (OSError, ValueError, IndexError):
+            tk.messagebox.showwarning("Warning", "Unable to parse kernel chain.")
+            return
+        self.reset()
+        self.actions.extend(actions)
+        for action in actions:
+            self.undobox.insert(tk.END, action.name)
+        self.preview_actions()
+        self.executeActions()
 
     def open_image(self):
-        path = tk.filedialog.askopenfile().name
+        path = tk.filedialog.askopenfilename()
         if not path:
             return
-        self.main_img = self.load_image(path)
+        try:
+            self.main_img = load_image(path)
+        except OSError:
+            tk.messagebox.showwarning("Warning", "Unable to open image.")
+            return
         self.original = self.main_img
-        self.display(self.main_img)
+        self.proxy_original = make_proxy(self.original)
+        self.reset()
 
     def run(self):
         self.window.mainloop()
 
     def reset(self):
+        # cancels any render that is still running
+        self.generation += 1
+        self.window.title("Filter Application")
         self.main_img = self.original.copy()
+        self.proxy_img = self.proxy_original
+        self.committed = self.generation
         self.display(self.main_img)
+        self.plan_label.config(text="")
         self.undobox.delete(0, tk.END)
         self.actions.clear()
+        self.cache.clear()
 
     def submit(self):
+        # the preset menu can submit before the startup image is loaded
+        if self.original is None:
+            return
         # read the kernel string
         text = self.input.get()
         # convert it to an array
         try:
-            kernel = self.string_to_kernel(text)
+            kernel = string_to_kernel(text)
         except:
             tk.messagebox.showwarning("Warning", "Unable to parse kernel.")
             return
-        # filter the image using the kernel
-        self.main_img = cv2.filter2D(self.main_img, -1, kernel)
-        # display the result
-        self.display(self.main_img)
+        action = Action(kernel, text)
+        # filter the proxy for instant feedback
+        self.proxy_img = self.proxy_chain([action]).execute(self.proxy_img)
+        self.display(self.proxy_img)
         # add it to the action recordings for undo
-        self.actions.append(Action(kernel, text))
+        self.actions.append(action)
         self.undobox.insert(tk.END, text)
+        # the full resolution result follows in the background
+        self.executeActions()
 
-    def string_to_kernel(self, text):
-        kernel = text.replace(" ", "").split(")(")
-        # removes the starting '(' and ending ')'
-        kernel[0], kernel[-1] = kernel[0][1:], kernel[-1][:-1]
-        # converts the row strings to integer lists
-        kernel = [[float(number) for number in row.split(',')] for row in kernel]
-        # create the kernel as numpy array and divide it by the kernel's sum
-        # the if statement is so we don't accidentally divide by 0
-        if sum(map(sum, kernel)):
-            kernel = np.array(kernel, np.float32) / sum(map(sum, kernel))
-        else:
-            kernel = np.array(kernel, np.float32)
-        return kernel
+    def proxy_chain(self, actions):
+        # compiles actions with their kernels scaled down to the proxy's resolution
+        scale_y = self.proxy_original.shape[0] / self.original.shape[0]
+        scale_x = self.proxy_original.shape[1] / self.original.shape[1]
+        scaled = [Action(scale_kernel(action.kernel, scale_y, scale_x), action.name)
+                  for action in actions]
+        return compile_chain(scaled, self.proxy_original.shape)
 
     def executeActions(self):
-        self.main_img = self.original.copy()
-        for action in self.actions:
-            self.main_img = cv2.filter2D(self.main_img, -1, action.kernel)
+        # cancel the render that is still running, its result would be stale
+        self.generation += 1
+        # replay from the closest checkpoint instead of the original image
+        start, image = self.cache.nearest(len(self.actions))
+        if image is None:
+            image = self.original
+        if start == len(self.actions):
+            self.commit(image)
+            return
+        plan = compile_chain(self.actions[start:], image.shape, self.fuse_kernels.get())
+        self.plan_label.config(text=plan.report(start) if self.fuse_kernels.get() else "")
+        self.window.title("Filter Application (rendering {}..)".format(
+            ", ".join(stage.method for stage in plan.stages)))
+        self.render_requests.put((self.generation, start, image, plan))
+
+    # runs on the worker thread, never touches tk
+    def render_worker(self):
+        while True:
+            request = self.render_requests.get()
+            # only the newest request is still wanted
+            while not self.render_requests.empty():
+                request = self.render_requests.get_nowait()
+            self.render(*request)
+
+    def render(self, generation, start, image, plan):
+        for stage, image in plan.run(image):
+            if generation != self.generation:
+                return
+            self.render_queue.put((generation, start + stage.stop, image))
+
+    # runs on the tk main thread, picks up results of the worker thread
+    def poll_render(self):
+        try:
+            while True:
+                generation, step, image = self.render_queue.get_nowait()
+                if generation != self.generation:
+                    continue
+                self.cache.put(step, image)
+                if step == len(self.actions):
+                    self.commit(image)
+        except queue.Empty:
+            pass
+        self.window.after(50, self.poll_render)
+
+    def commit(self, image):
+        self.window.title("Filter Application")
+        self.main_img = image
+        self.committed = self.generation
+        self.proxy_img = make_proxy(image)
         self.display(self.main_img)
 
     def undo(self):
@@ -190,7 +1073,9 @@ class Application:
         self.actions.pop()
         self.undobox.delete(tk.END, tk.END)
 
-        self.main_img = self.original.copy()
+        # the previous result is normally still cached, making this a lookup
+        self.cache.invalidate(len(self.actions))
+        self.preview_actions()
         self.executeActions()
 
     def del_action(self):
@@ -201,10 +1086,21 @@ class Application:
         self.input.insert(0, self.actions[index].name)
         self.actions.pop(index)
         self.undobox.delete(index)
+        # results up to the deleted action stay valid, everything after it is stale
+        self.cache.invalidate(index)
+        self.preview_actions()
         self.executeActions()
 
+    def preview_actions(self):
+        # replays the whole chain on the proxy, which is cheap at its resolution
+        self.proxy_img = self.proxy_chain(self.actions).execute(self.proxy_original)
+        self.display(self.proxy_img)
+
 
 def main():
+    # any command line arguments run the headless batch mode
+    if len(sys.argv) > 1:
+        sys.exit(batch_main(sys.argv[1:]))
     app = Application()
     app.run()
 
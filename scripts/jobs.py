@@ -0,0 +1,60 @@
+# ------------------------------------------------------
+# ---------------------- jobs.py -----------------------
+# ------------------------------------------------------
+""" Background jobs for Qt windows. A job runs a work function on a QThreadPool
+thread and hands its partial and final results back to the GUI thread through
+queued signals, so plotting stays on the GUI thread. """
+
+import time
+import traceback
+
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+# minimum number of seconds between two partial results
+PROGRESS_INTERVAL = 0.25
+
+
+class JobSignals(QObject):
+    # (job, partial result, fraction done)
+    progress = pyqtSignal(object, object, float)
+    # (job, result)
+    finished = pyqtSignal(object, object)
+    # (job, error text)
+    failed = pyqtSignal(object, str)
+
+
+class Job(QRunnable):
+    """ Calls work(job) on a pool thread. Long running work calls job.report with
+    what it has so far and returns early once job.cancelled is set, cancelled
+    jobs never emit finished. """
+
+    def __init__(self, name, work, axis=0, done=None):
+        QRunnable.__init__(self)
+        self.name = name
+        self.work = work
+        self.axis = axis
+        # called with the result on the GUI thread after it has been shown
+        self.done = done
+        self.cancelled = False
+        self.last_report = time.perf_counter()
+        # created on the GUI thread, so connected slots run there
+        self.signals = JobSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    # throttled, so the GUI thread only redraws a few times per second
+    def report(self, partial, fraction):
+        now = time.perf_counter()
+        if not self.cancelled and now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            self.signals.progress.emit(self, partial, fraction)
+
+    def run(self):
+        try:
+            result = self.work(self)
+        except Exception:
+            self.signals.failed.emit(self, traceback.format_exc())
+            return
+        if not self.cancelled:
+            self.signals.finished.emit(self, result)
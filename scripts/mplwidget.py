@@ -7,20 +7,119 @@ from matplotlib.backends.backend_qt5agg import FigureCanvas
 
 from matplotlib.figure import Figure
 
-    
+import numpy as np
+
+
+class EnvelopePyramid:
+    """ Min/max envelopes of a signal at power of two bin sizes, computed once so
+    any range of the signal can be drawn at screen resolution in constant time. """
+
+    # finest bin size that gets stored, finer ranges are reduced from the raw data
+    FIRST_LEVEL = 6
+
+    def __init__(self, data, chunk_size=2**20):
+        self.data = data
+        self.levels = dict()
+        self.chunk_size = chunk_size
+        self.update(0)
+
+    # reduces the data from sample start on, the bins before it are kept
+    def update(self, start):
+        bin_size = 2**self.FIRST_LEVEL
+        # the first level is built in chunks, so memory mapped data is only paged in once
+        chunk_size = max(self.chunk_size // bin_size, 1) * bin_size
+        # the last bin may have been partial, it is reduced again
+        first = start // bin_size
+        level = self.FIRST_LEVEL
+        if level in self.levels:
+            mins, maxs = [self.levels[level][0][:first]], [self.levels[level][1][:first]]
+        else:
+            mins, maxs = list(), list()
+        for begin in range(first * bin_size, len(self.data), chunk_size):
+            chunk = np.asarray(self.data[begin:begin + chunk_size])
+            mins.append(np.minimum.reduceat(chunk, np.arange(0, len(chunk), bin_size)))
+            maxs.append(np.maximum.reduceat(chunk, np.arange(0, len(chunk), bin_size)))
+        if not mins:
+            return
+        self.levels[level] = (np.concatenate(mins), np.concatenate(maxs))
+        # every next level halves the previous one
+        while len(self.levels[level][0]) > 1:
+            lo, hi = self.levels[level]
+            first //= 2
+            starts = np.arange(2 * first, len(lo), 2)
+            level += 1
+            old_lo, old_hi = self.levels.get(level, (lo[:0], hi[:0]))
+            self.levels[level] = (
+                np.concatenate((old_lo[:first], np.minimum.reduceat(lo, starts))),
+                np.concatenate((old_hi[:first], np.maximum.reduceat(hi, starts))))
+
+    def extend(self, data):
+        """ Points the pyramid at data, which starts with the data it was built from,
+        and only reduces the samples that were added. Lets a line grow with a
+        result that is still being computed in linear total time. """
+        start = len(self.data)
+        self.data = data
+        self.update(start)
+
+    def __len__(self):
+        return len(self.data)
+
+    def levels_for(self, samples_per_pixel):
+        # coarsest level that still has at least two bins per pixel, 0 means raw data
+        levels = np.floor(np.log2(np.maximum(samples_per_pixel, 1))).astype(int) - 1
+        levels[levels < self.FIRST_LEVEL] = 0
+        return np.minimum(levels, max(self.levels, default=0))
+
+    def envelope(self, edges):
+        """ Returns (indices, values) of a min/max line that covers every segment
+        between consecutive sample index edges with a min and a max point. """
+        edges = np.unique(np.clip(np.asarray(edges, dtype=np.int64), 0, len(self.data)))
+        if len(edges) < 2:
+            return np.empty(0), np.empty(0)
+        # few samples per pixel, just draw them as they are
+        if edges[-1] - edges[0] <= 4 * (len(edges) - 1):
+            indices = np.arange(edges[0], edges[-1])
+            return indices, np.asarray(self.data[edges[0]:edges[-1]])
+
+        starts = edges[:-1]
+        levels = self.levels_for(np.diff(edges))
+        xs, ys = list(), list()
+        # segments of the same level are contiguous, for linear and log axes alike
+        for level in np.unique(levels):
+            segment = starts[levels == level]
+            first, last = segment[0], edges[np.searchsorted(edges, segment[-1]) + 1]
+            if level == 0:
+                lo = hi = np.asarray(self.data[first:last])
+                offsets = segment - first
+            else:
+                lo, hi = self.levels[level]
+                begin, end = first >> level, max(((last - 1) >> level) + 1, (first >> level) + 1)
+                lo, hi = lo[begin:end], hi[begin:end]
+                offsets = np.minimum((segment >> level) - begin, len(lo) - 1)
+            xs.append(np.repeat(segment, 2))
+            ys.append(np.column_stack((np.minimum.reduceat(lo, offsets),
+                                       np.maximum.reduceat(hi, offsets))).ravel())
+        return np.concatenate(xs), np.concatenate(ys)
+
+
 class MplWidget(QWidget):
-    
+
     def __init__(self, parent = None):
 
         QWidget.__init__(self, parent)
-        
+
         self.canvas = FigureCanvas(Figure())
-        
+
         vertical_layout = QVBoxLayout()
         vertical_layout.addWidget(self.canvas)
-        
+
         self.canvas.axes = self.canvas.figure.subplots(nrows=2, ncols=1)
 
+        # decimated lines as (axes, line, pyramid, x scale) tuples
+        self.lod_lines = list()
+        # (axes, image, data, framerate, stft manager) while an axes shows a spectrogram
+        self.spectrogram = None
+
         self.init_axes()
 
         self.setLayout(vertical_layout)
@@ -37,7 +136,105 @@ class MplWidget(QWidget):
         self.canvas.axes[1].set_xlabel('frequency [Hz]')
         self.canvas.axes[1].set_ylabel('|amplitude|')
 
+        # clearing the axes also drops their callbacks, so connect them here
+        for axes in self.canvas.axes:
+            axes.callbacks.connect('xlim_changed', self.update_lod)
+
     def clear_axes(self):
         self.canvas.axes[0].cla()
         self.canvas.axes[1].cla()
+        self.lod_lines.clear()
+        self.spectrogram = None
+
+    # plots data against index * x_scale, only drawing what is visible at screen resolution
+    def plot_decimated(self, index, data, x_scale=1.0, pyramid=None, **kwargs):
+        axes = self.canvas.axes[index]
+        line, = axes.plot([], [], **kwargs)
+        self.lod_lines.append((axes, line, pyramid, x_scale))
+        self.replace_decimated(line, data, x_scale, pyramid)
+        return line
+
+    # swaps the data of a decimated line, used to grow a line while its data is computed
+    def replace_decimated(self, line, data, x_scale=1.0, pyramid=None):
+        if pyramid is None:
+            pyramid = EnvelopePyramid(data)
+        for i, (axes, lod_line, _, _) in enumerate(self.lod_lines):
+            if lod_line is line:
+                self.lod_lines[i] = (axes, line, pyramid, x_scale)
+                # start with the whole signal so the axes can autoscale to it
+                self.set_lod_data(line, pyramid, x_scale, 0, len(pyramid), axes)
+                axes.relim()
+                axes.autoscale_view()
+
+    def remove_decimated(self, line):
+        self.lod_lines = [entry for entry in self.lod_lines if entry[1] is not line]
+        line.remove()
+
+    def pyramid(self, line):
+        for _, lod_line, pyramid, _ in self.lod_lines:
+            if lod_line is line:
+                return pyramid
+
+    def update_lod(self, axes):
+        for lod_axes, line, pyramid, x_scale in self.lod_lines:
+            if lod_axes is axes:
+                start, stop = axes.get_xlim()
+                self.set_lod_data(line, pyramid, x_scale, start / x_scale, stop / x_scale, axes)
+        if self.spectrogram is not None and self.spectrogram[0] is axes:
+            self.update_spectrogram()
+        self.canvas.draw_idle()
+
+    # shows a spectrogram of data against time instead of lines, only the frames of
+    # the visible time range are computed and they are redone when it changes
+    def plot_spectrogram(self, index, data, framerate, stft):
+        axes = self.canvas.axes[index]
+        for line in [entry[1] for entry in self.lod_lines if entry[0] is axes]:
+            self.remove_decimated(line)
+        if self.spectrogram is not None and self.spectrogram[0] is axes:
+            self.spectrogram[1].remove()
+        axes.set_xscale('linear')
+        axes.set_xlabel('time [s]')
+        axes.set_ylabel('frequency [Hz]')
+        image = axes.imshow(np.zeros((1, 1)), aspect='auto', origin='lower',
+                            interpolation='nearest', cmap='magma')
+        self.spectrogram = (axes, image, data, framerate, stft)
+        # fixed limits, so updating the image extent doesn't move them again
+        axes.set_autoscale_on(False)
+        axes.set_ylim(0, framerate / 2)
+        axes.set_xlim(0, len(data) / framerate)
+        self.update_spectrogram()
+
+    def update_spectrogram(self):
+        axes, image, data, framerate, stft = self.spectrogram
+        start, stop = axes.get_xlim()
+        frames, magnitudes = stft.visible(data, start * framerate, stop * framerate,
+                                          max(int(axes.bbox.width), 1))
+        if len(frames) == 0:
+            image.set_data(np.zeros((1, 1)))
+            return
+        # every column spans the frame spacing around the frame center
+        step = (frames[1] - frames[0]) * stft.hop if len(frames) > 1 else stft.window_size
+        left = (stft.frame_center(frames[0]) - step / 2) / framerate
+        right = (stft.frame_center(frames[-1]) + step / 2) / framerate
+        image.set_data(magnitudes.T)
+        image.set_extent((left, right, 0, framerate / 2))
+        # 90 dB below the loudest visible bin is shown as silence
+        peak = float(magnitudes.max())
+        image.set_clim(peak - 90, peak)
 
+    def set_lod_data(self, line, pyramid, x_scale, start, stop, axes):
+        pixels = max(int(axes.bbox.width), 1)
+        start, stop = max(start, 0), min(stop, len(pyramid))
+        if axes.get_xscale() == 'log':
+            start = max(start, 1)
+        if stop <= start:
+            line.set_data([], [])
+            return
+        # one segment per pixel column, geometric on log axes
+        if axes.get_xscale() == 'log':
+            edges = np.geomspace(start, stop, pixels + 1)
+        else:
+            edges = np.linspace(start, stop, pixels + 1)
+        edges = np.concatenate(([np.floor(edges[0])], np.ceil(edges[1:])))
+        indices, values = pyramid.envelope(edges)
+        line.set_data(indices * x_scale, values)
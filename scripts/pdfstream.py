@@ -0,0 +1,186 @@
+# ------------------------------------------------------
+# -------------------- pdfstream.py --------------------
+# ------------------------------------------------------
+""" Writes pdf files with one image per page straight to disk, so documents with
+thousands of pages never have to fit in memory. JPEG files are embedded as they
+are and decoded by the pdf viewer, other images are decoded once with PIL and
+stored deflate compressed. """
+
+import os
+import shutil
+import struct
+import zlib
+
+# start of frame markers of baseline, extended and progressive huffman jpegs,
+# the jpeg flavours every pdf viewer can decode
+JPEG_FRAME_MARKERS = (0xC0, 0xC1, 0xC2)
+# jpeg component count or PIL mode -> pdf color space
+JPEG_COLOR_SPACES = {1: "/DeviceGray", 3: "/DeviceRGB", 4: "/DeviceCMYK"}
+PIL_COLOR_SPACES = {"L": "/DeviceGray", "RGB": "/DeviceRGB", "CMYK": "/DeviceCMYK"}
+
+
+class PdfImage:
+    """ An image ready to be written, either compressed data in memory or a jpeg
+    file that is copied into the pdf when its page is written. """
+
+    def __init__(self, width, height, color_space, encoding, data=None, path=None, decode=None):
+        self.width = width
+        self.height = height
+        self.color_space = color_space
+        self.encoding = encoding
+        self.data = data
+        self.path = path
+        self.decode = decode
+
+
+# reads the frame header of a jpeg file without decoding it, returns
+# (width, height, components, adobe) or None when it can't be passed through
+def jpeg_header(path):
+    adobe = False
+    with open(path, "rb") as file:
+        if file.read(2) != b"\xff\xd8":
+            return None
+        while True:
+            if file.read(1) != b"\xff":
+                return None
+            marker = file.read(1)
+            # markers may be preceded by any number of fill bytes
+            while marker == b"\xff":
+                marker = file.read(1)
+            if not marker:
+                return None
+            marker = marker[0]
+            if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                continue
+            # end of image or start of scan before any frame header
+            if marker in (0xD9, 0xDA):
+                return None
+            length = struct.unpack(">H", file.read(2))[0]
+            segment = file.read(length - 2)
+            if marker == 0xEE and segment.startswith(b"Adobe"):
+                adobe = True
+            elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                if marker not in JPEG_FRAME_MARKERS or len(segment) < 6:
+                    return None
+                precision, height, width, components = struct.unpack(">BHHB", segment[:6])
+                # 12 bit extended jpegs can't be written with /BitsPerComponent 8
+                if precision != 8 or height == 0 or components not in JPEG_COLOR_SPACES:
+                    return None
+                return width, height, components, adobe
+
+
+def flatten(image):
+    # pdf images are written without a soft mask, transparent areas become white
+    from PIL import Image
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        flat = Image.new("RGB", rgba.size, (255, 255, 255))
+        flat.paste(rgba, mask=rgba.getchannel("A"))
+        return flat
+    if image.mode in PIL_COLOR_SPACES:
+        return image
+    if image.mode.startswith("I;16"):
+        # convert("L") would clip the 16 bit values instead of scaling them
+        return image.convert("I").point(lambda v: v / 257).convert("L")
+    if image.mode in ("I", "F"):
+        low, high = image.getextrema()
+        if low < 0 or high > 255:
+            # no fixed range, the values are stretched over 0-255
+            scale = 255 / (high - low) if high > low else 0
+            image = image.point(lambda v: (v - low) * scale)
+        return image.convert("L")
+    if image.mode == "1":
+        return image.convert("L")
+    return image.convert("RGB")
+
+
+def load_image(path):
+    """ Returns a PdfImage of the image file at path, raises OSError when it
+    can't be read. JPEG files are only parsed up to their frame header. """
+    header = jpeg_header(path)
+    if header is not None:
+        width, height, components, adobe = header
+        # adobe applications store cmyk jpegs inverted
+        decode = "[1 0 1 0 1 0 1 0]" if components == 4 and adobe else None
+        return PdfImage(width, height, JPEG_COLOR_SPACES[components], "/DCTDecode",
+                        path=path, decode=decode)
+
+    from PIL import Image
+    with Image.open(path) as image:
+        image = flatten(image)
+        data = zlib.compress(image.tobytes(), 6)
+    return PdfImage(image.width, image.height, PIL_COLOR_SPACES[image.mode], "/FlateDecode",
+                    data=data)
+
+
+class PdfWriter:
+    """ Writes every object as soon as it is added. Only the byte offsets of the
+    objects and the page numbers are kept, the page tree and the cross reference
+    table are written on close. Pages are one point per image pixel. """
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        # object number -> byte offset, 1 is the catalog and 2 the page tree
+        self.offsets = [None, None, None]
+        self.pages = list()
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def begin_object(self, number=None):
+        if number is None:
+            number = len(self.offsets)
+            self.offsets.append(None)
+        self.offsets[number] = self.file.tell()
+        self.file.write(b"%d 0 obj\n" % number)
+        return number
+
+    def write_object(self, body, number=None):
+        number = self.begin_object(number)
+        self.file.write(body.encode("latin-1") + b"\nendobj\n")
+        return number
+
+    # a stream from data in memory, or copied from the file at path
+    def write_stream(self, dictionary, data=None, path=None):
+        number = self.begin_object()
+        length = len(data) if path is None else os.path.getsize(path)
+        self.file.write("<< {} /Length {} >>\nstream\n".format(dictionary, length).encode("latin-1"))
+        if path is None:
+            self.file.write(data)
+        else:
+            with open(path, "rb") as source:
+                shutil.copyfileobj(source, self.file)
+        self.file.write(b"\nendstream\nendobj\n")
+        return number
+
+    def add_image_page(self, image):
+        dictionary = ("/Type /XObject /Subtype /Image /Width {} /Height {} /ColorSpace {} "
+                      "/BitsPerComponent 8 /Filter {}").format(
+            image.width, image.height, image.color_space, image.encoding)
+        if image.decode:
+            dictionary += " /Decode " + image.decode
+        xobject = self.write_stream(dictionary, image.data, image.path)
+        # scale the unit square the image is drawn in to the page size
+        content = "q {} 0 0 {} 0 0 cm /Im0 Do Q".format(image.width, image.height)
+        contents = self.write_stream("", content.encode("latin-1"))
+        self.pages.append(self.write_object(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {} {}] "
+            "/Resources << /XObject << /Im0 {} 0 R >> >> /Contents {} 0 R >>".format(
+                image.width, image.height, xobject, contents)))
+
+    def close(self):
+        kids = " ".join("{} 0 R".format(page) for page in self.pages)
+        self.write_object("<< /Type /Pages /Kids [{}] /Count {} >>".format(kids, len(self.pages)), 2)
+        self.write_object("<< /Type /Catalog /Pages 2 0 R >>", 1)
+        xref = self.file.tell()
+        self.file.write("xref\n0 {}\n".format(len(self.offsets)).encode("latin-1"))
+        self.file.write(b"0000000000 65535 f \n")
+        for offset in self.offsets[1:]:
+            self.file.write(b"%010d 00000 n \n" % offset)
+        self.file.write("trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n".format(
+            len(self.offsets), xref).encode("latin-1"))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,197 @@
+# ------------------------------------------------------
+# ------------------ slidingwindow.py ------------------
+# ------------------------------------------------------
+""" Fast centered sliding window statistics for signals. Arrays are filtered along
+their first axis, so a (frames, channels) array filters every channel in one call.
+Windows are k samples wide (k is made odd) and centered on the output sample. Near
+the edges the signal is extended with its first and last sample, except for
+moving_mean, which averages only the samples that exist. The *_valid functions skip
+that extension and return the len(x) - k + 1 fully covered windows, which is what
+block-wise filters build on. """
+
+import heapq
+from functools import lru_cache
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# without the fast ndimage path, windows up to this size are selected with
+# np.partition on strided views and larger ones with a pair of heaps
+SMALL_WINDOW = 31
+# number of windows partitioned at once, bounds the memory of the strided copy
+PARTITION_CHUNK = 2**16
+
+
+# scipy 1.15 added an O(n log k) 1D rank filter to ndimage. scipy is imported
+# on first use so importing this module stays cheap.
+@lru_cache(maxsize=None)
+def fast_ndimage():
+    import scipy
+    return tuple(int(part) for part in scipy.__version__.split(".")[:2]) >= (1, 15)
+
+
+def odd(k):
+    return max(int(k), 1) // 2 * 2 + 1
+
+
+def pad_widths(x, half):
+    # only pad the first axis
+    return ((half, half),) + ((0, 0),) * (np.ndim(x) - 1)
+
+
+def pad_edges(x, k):
+    half = odd(k) // 2
+    return np.pad(np.asarray(x, dtype=float), pad_widths(x, half), mode="edge")
+
+
+def window_size(x, k):
+    # ndimage size argument that only spans the first axis
+    return (k,) + (1,) * (np.ndim(x) - 1)
+
+
+def rank_partition(x, k, rank):
+    # O(n k) but vectorized, the fastest option for small windows
+    windows = sliding_window_view(x, k, axis=0)
+    output = np.empty(windows.shape[:-1])
+    for start in range(0, len(windows), PARTITION_CHUNK):
+        chunk = windows[start:start + PARTITION_CHUNK]
+        output[start:start + len(chunk)] = np.partition(chunk, rank, axis=-1)[..., rank]
+    return output
+
+
+def rank_heap_window(x, k, rank):
+    """ O(n log k) running rank: a max-heap holds the rank + 1 smallest values of
+    the window and a min-heap the others, so the answer is the top of the first.
+    Samples that leave the window are only marked and popped once they reach the
+    top of a heap. """
+    if x.ndim > 1:
+        return np.stack([rank_heap_window(x[:, channel], k, rank)
+                         for channel in range(x.shape[1])], axis=1)
+    values = x.tolist()
+    output = np.empty(len(values) - k + 1)
+    # entries are (value, index) and (-value, -index) so equal values are ordered
+    first = sorted((values[index], index) for index in range(k))
+    low = [(-value, -index) for value, index in first[:rank + 1]]
+    high = first[rank + 1:]
+    heapq.heapify(low)
+    in_low = bytearray(len(values))
+    for _, index in first[:rank + 1]:
+        in_low[index] = 1
+    low_size = rank + 1
+    output[0] = first[rank][0]
+
+    for i in range(k, len(values)):
+        oldest = i - k
+        if in_low[oldest]:
+            low_size -= 1
+        # drop marked entries from the tops before comparing with them
+        while low and -low[0][1] <= oldest:
+            heapq.heappop(low)
+        while high and high[0][1] <= oldest:
+            heapq.heappop(high)
+
+        value = values[i]
+        if low and (value, i) < (-low[0][0], -low[0][1]):
+            heapq.heappush(low, (-value, -i))
+            in_low[i] = 1
+            low_size += 1
+        else:
+            heapq.heappush(high, (value, i))
+
+        # move tops across until low holds exactly rank + 1 live samples
+        if low_size > rank + 1:
+            value, index = heapq.heappop(low)
+            heapq.heappush(high, (-value, -index))
+            in_low[-index] = 0
+            low_size -= 1
+        elif low_size < rank + 1:
+            value, index = heapq.heappop(high)
+            heapq.heappush(low, (-value, -index))
+            in_low[index] = 1
+            low_size += 1
+        while low and -low[0][1] <= oldest:
+            heapq.heappop(low)
+        while high and high[0][1] <= oldest:
+            heapq.heappop(high)
+
+        # marked entries below the tops pile up, rebuilding keeps the heaps O(k)
+        if len(low) + len(high) > 2 * k:
+            low = [entry for entry in low if -entry[1] > oldest]
+            high = [entry for entry in high if entry[1] > oldest]
+            heapq.heapify(low)
+            heapq.heapify(high)
+        output[i - k + 1] = -low[0][0]
+    return output
+
+
+def rank_valid(x, k, rank):
+    """ The rank-th smallest value of every fully covered window of size k. """
+    x = np.asarray(x, dtype=float)
+    if len(x) < k:
+        return np.empty((0,) + x.shape[1:])
+    if fast_ndimage():
+        from scipy import ndimage
+        half = k // 2
+        return ndimage.rank_filter(x, rank, size=window_size(x, k))[half:len(x) - half]
+    if k <= SMALL_WINDOW:
+        return rank_partition(x, k, rank)
+    return rank_heap_window(x, k, rank)
+
+
+def percentile_rank(k, q):
+    return int(round(q / 100 * (k - 1)))
+
+
+def running_percentile(x, k, q):
+    k = odd(k)
+    return rank_valid(pad_edges(x, k), k, percentile_rank(k, q))
+
+
+def running_median(x, k):
+    k = odd(k)
+    return rank_valid(pad_edges(x, k), k, k // 2)
+
+
+def min_valid(x, k):
+    from scipy import ndimage
+    half = k // 2
+    return ndimage.minimum_filter1d(np.asarray(x, dtype=float), k, axis=0)[half:len(x) - half]
+
+
+def max_valid(x, k):
+    from scipy import ndimage
+    half = k // 2
+    return ndimage.maximum_filter1d(np.asarray(x, dtype=float), k, axis=0)[half:len(x) - half]
+
+
+# extending with the edge sample doesn't change a min or max, so these equal
+# the statistic over only the samples that exist
+def moving_min(x, k):
+    from scipy import ndimage
+    return ndimage.minimum_filter1d(np.asarray(x, dtype=float), odd(k), axis=0, mode="nearest")
+
+
+def moving_max(x, k):
+    from scipy import ndimage
+    return ndimage.maximum_filter1d(np.asarray(x, dtype=float), odd(k), axis=0, mode="nearest")
+
+
+def sum_valid(x, k):
+    # window sums from a cumulative sum, as described by:
+    # https://numpy.org/doc/stable/reference/generated/numpy.cumsum.html
+    x = np.asarray(x)
+    sums = np.concatenate((np.zeros((1,) + x.shape[1:]), np.cumsum(x, axis=0, dtype=float)))
+    return sums[k:] - sums[:-k]
+
+
+def moving_mean(x, k):
+    """ Centered mean over k samples. Unlike a trailing cumulative sum the result
+    is not shifted, and edge windows are divided by the number of samples they
+    actually cover instead of k. """
+    k = odd(k)
+    half = k // 2
+    x = np.asarray(x, dtype=float)
+    sums = sum_valid(np.pad(x, pad_widths(x, half)), k)
+    index = np.arange(len(x))
+    counts = np.minimum(index, half) + 1 + np.minimum(len(x) - 1 - index, half)
+    return sums / counts.reshape((-1,) + (1,) * (x.ndim - 1))
@@ -0,0 +1,72 @@
+# ------------------------------------------------------
+# --------------------- spectrum.py --------------------
+# ------------------------------------------------------
+""" Magnitude spectra computed with FFTs padded to fast lengths, cached by the
+identity of the array they were computed from. Safe to share between the GUI
+thread and background jobs. """
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SpectrumManager:
+
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        # id(data) -> (data, magnitude), the data reference keeps the id from being reused
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.last_timing = None
+
+    # smallest length >= n that factors into small primes, zero padding up to
+    # it keeps prime length signals from falling back to slow transforms
+    def fft_length(self, n):
+        from scipy import fft
+        return fft.next_fast_len(n, real=True)
+
+    # bin frequency spacing of a spectrum of a signal with the given length
+    def bin_width(self, length, framerate):
+        return framerate / self.fft_length(length)
+
+    def magnitude(self, data):
+        with self.lock:
+            entry = self.cache.get(id(data))
+            if entry is not None and entry[0] is data:
+                self.cache.move_to_end(id(data))
+                self.last_timing = ("rfft", 0.0, True)
+                return entry[1]
+
+        # the transform itself runs unlocked, so jobs don't wait on each other
+        from scipy import fft
+        start = time.perf_counter()
+        spectrum = np.abs(fft.rfft(data, n=self.fft_length(len(data)), workers=-1))
+        self.last_timing = ("rfft", time.perf_counter() - start, False)
+
+        with self.lock:
+            self.cache[id(data)] = (data, spectrum)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        return spectrum
+
+    # back to the time domain, cut to the length of the original signal
+    def irfft(self, spectrum, length):
+        from scipy import fft
+        start = time.perf_counter()
+        data = fft.irfft(spectrum, n=self.fft_length(length), workers=-1)[:length]
+        self.last_timing = ("irfft", time.perf_counter() - start, False)
+        return data
+
+    def timing_text(self):
+        if self.last_timing is None:
+            return ""
+        name, seconds, cached = self.last_timing
+        if cached:
+            return "{}: cached".format(name)
+        return "{}: {:.1f} ms".format(name, seconds * 1000)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
@@ -0,0 +1,123 @@
+# ------------------------------------------------------
+# ----------------------- stft.py ----------------------
+# ------------------------------------------------------
+""" Short time Fourier transforms of long signals, computed only for the frames
+that are on screen. Frames are transformed in chunks on a thread pool and the
+chunks are cached, the least recently used ones are dropped once the cache
+outgrows its byte budget. """
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# frames per cached chunk
+CHUNK_FRAMES = 64
+# magnitudes are floored here so silence doesn't become -inf
+MIN_DB = -200.0
+
+
+class STFTManager:
+    """ Magnitude STFT frames in dB. Frame i covers samples [i * hop, i * hop + window_size),
+    signals shorter than a frame are zero padded to one frame. """
+
+    def __init__(self, window_size=1024, hop=256, window="hann", budget=64 * 2**20, workers=None):
+        self.window_size = window_size
+        self.hop = hop
+        self.window = window
+        self.budget = budget
+        # (id(data), window_size, hop, window, stride, chunk) -> (data, magnitudes),
+        # the data reference keeps the id from being reused
+        self.cache = OrderedDict()
+        self.bytes_held = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(workers)
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, window_size, hop, window=None):
+        # cached chunks of other settings stay until they are evicted
+        self.window_size = max(int(window_size), 2)
+        self.hop = max(int(hop), 1)
+        if window is not None:
+            self.window = window
+
+    def frame_count(self, length):
+        if length == 0:
+            return 0
+        return max((length - self.window_size) // self.hop + 1, 1)
+
+    def bins(self):
+        return self.window_size // 2 + 1
+
+    # sample index of the middle of a frame
+    def frame_center(self, frame):
+        return frame * self.hop + self.window_size / 2
+
+    def compute_chunk(self, data, stride, chunk):
+        from scipy import fft
+        from scipy import signal as sp
+        frames = (chunk * CHUNK_FRAMES + np.arange(CHUNK_FRAMES)) * stride
+        frames = frames[frames < self.frame_count(len(data))]
+        indices = frames[:, np.newaxis] * self.hop + np.arange(self.window_size)
+        # gathering with indices only reads the pages of memory mapped data that are used
+        inside = indices < len(data)
+        segments = np.asarray(data)[np.minimum(indices, len(data) - 1)] * inside
+        segments = segments * sp.get_window(self.window, self.window_size)
+        spectrum = np.abs(fft.rfft(segments, axis=-1))
+        return (20 * np.log10(np.maximum(spectrum, 10**(MIN_DB / 20)))).astype(np.float32)
+
+    def chunks(self, data, stride, chunk_indices):
+        keys = [(id(data), self.window_size, self.hop, self.window, stride, chunk)
+                for chunk in chunk_indices]
+        found = dict()
+        with self.lock:
+            for key in keys:
+                entry = self.cache.get(key)
+                if entry is not None and entry[0] is data:
+                    self.cache.move_to_end(key)
+                    found[key] = entry[1]
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        # the missing chunks are transformed in parallel, the fft releases the gil
+        missing = [key for key in keys if key not in found]
+        results = self.executor.map(lambda key: self.compute_chunk(data, stride, key[-1]), missing)
+        for key, magnitudes in zip(missing, results):
+            found[key] = magnitudes
+
+        with self.lock:
+            for key in missing:
+                if key not in self.cache:
+                    self.cache[key] = (data, found[key])
+                    self.bytes_held += found[key].nbytes
+            while self.bytes_held > self.budget and len(self.cache) > 1:
+                _, (_, magnitudes) = self.cache.popitem(last=False)
+                self.bytes_held -= magnitudes.nbytes
+        return [found[key] for key in keys]
+
+    def visible(self, data, start, stop, columns):
+        """ Returns (frames, magnitudes) of the frames that overlap samples [start, stop),
+        a (frames, bins) array. When there are more frames than columns only every
+        stride-th frame is computed, with a power of two stride so zooming reuses chunks. """
+        count = self.frame_count(len(data))
+        first = max(int(np.ceil((start - self.window_size) / self.hop)), 0)
+        last = min(int(np.floor(stop / self.hop)), count - 1)
+        if last < first:
+            return np.empty(0, dtype=int), np.empty((0, self.bins()), dtype=np.float32)
+
+        stride = 1
+        while (last - first) // stride + 1 > max(columns, 1):
+            stride *= 2
+        first, last = first // stride, last // stride
+        chunk_indices = range(first // CHUNK_FRAMES, last // CHUNK_FRAMES + 1)
+        magnitudes = np.concatenate(self.chunks(data, stride, chunk_indices))
+        offset = first - chunk_indices[0] * CHUNK_FRAMES
+        magnitudes = magnitudes[offset:offset + last - first + 1]
+        return np.arange(first, first + len(magnitudes)) * stride, magnitudes
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.bytes_held = 0
@@ -0,0 +1,142 @@
+# ------------------------------------------------------
+# -------------------- throughput.py -------------------
+# ------------------------------------------------------
+""" Download rates of watched folders over time. Every measurement of how much
+was written to a folder becomes a sample with its byte rate and an exponentially
+smoothed rate. Stalls are judged on the measured rates, so a finished download is
+noticed right away, and the ETA on the smoothed ones. The samples can be exported
+as CSV or JSON. """
+
+import os
+import csv
+import json
+import math
+import time
+from collections import deque
+
+# a folder writing less than STALL_RATE bytes per second for STALL_TIME seconds is idle
+STALL_RATE = 64 * 2**10
+STALL_TIME = 15
+# seconds it takes the smoothed rate to move 63% of the way to a new rate,
+# independent of how often the folders are measured
+SMOOTHING = 10
+# samples kept per folder, an hour at one sample a second
+HISTORY = 3600
+FIELDS = ("time", "directory", "seconds", "bytes", "total", "rate", "smoothed")
+
+
+class RateSeries:
+    """ The samples of one folder, (wall time, seconds, bytes written, total
+    written, rate, smoothed rate), oldest first. """
+
+    def __init__(self, smoothing=SMOOTHING, history=HISTORY):
+        self.smoothing = smoothing
+        self.samples = deque(maxlen=history)
+        self.total = 0
+        self.smoothed = None
+        # monotonic time the folder went idle, None while it is writing
+        self.idle_since = None
+
+    def add(self, now, seconds, writes, delta, stall_rate):
+        rate = max(delta, 0) / seconds if seconds > 0 else 0.0
+        if self.smoothed is None:
+            self.smoothed = rate
+        else:
+            weight = 1 - math.exp(-seconds / self.smoothing) if self.smoothing > 0 else 1.0
+            self.smoothed = weight * rate + (1 - weight) * self.smoothed
+        self.total += delta
+        self.samples.append((time.time(), seconds, delta, self.total, rate, self.smoothed))
+
+        # writes that don't change the size are rewrites of preallocated files,
+        # their rate can't be measured so they always count as activity
+        if rate >= stall_rate or (writes and delta == 0):
+            self.idle_since = None
+        elif self.idle_since is None:
+            self.idle_since = now - seconds
+
+    def idle_time(self, now):
+        return 0.0 if self.idle_since is None else now - self.idle_since
+
+    def eta(self, remaining):
+        """ Seconds until remaining more bytes are written at the smoothed rate,
+        None when that can't be told. """
+        if remaining is None or not self.smoothed:
+            return None
+        return remaining / self.smoothed
+
+
+class Throughput:
+    """ Rate series of a set of folders, fed with the activity a change watch
+    backend returns: {directory: (writes, bytes written)}. """
+
+    def __init__(self, directories, stall_rate=STALL_RATE, stall_time=STALL_TIME,
+                 smoothing=SMOOTHING, history=HISTORY):
+        self.stall_rate = stall_rate
+        self.stall_time = stall_time
+        self.series = {directory: RateSeries(smoothing, history) for directory in sorted(directories)}
+        self.last = time.monotonic()
+
+    def add(self, activity):
+        now = time.monotonic()
+        seconds = now - self.last
+        self.last = now
+        for directory, (writes, delta) in activity.items():
+            if directory in self.series:
+                self.series[directory].add(now, seconds, writes, delta, self.stall_rate)
+
+    def rate(self):
+        return sum(series.smoothed or 0.0 for series in self.series.values())
+
+    # seconds every folder has been idle, 0 while any of them is writing. folders
+    # the backend never reported on have no say
+    def idle_time(self):
+        now = time.monotonic()
+        return min((series.idle_time(now) for series in self.series.values() if series.samples),
+                   default=0.0)
+
+    def idle(self):
+        return self.idle_time() >= self.stall_time
+
+    def eta(self, remaining):
+        """ Seconds until every folder wrote its remaining bytes, remaining maps
+        folders to bytes or None when unknown. None when no folder can tell. """
+        etas = [self.series[directory].eta(left) for directory, left in remaining.items()
+                if directory in self.series]
+        etas = [eta for eta in etas if eta is not None]
+        return max(etas) if etas else None
+
+    def rows(self):
+        for directory, series in self.series.items():
+            for sample in series.samples:
+                yield dict(zip(FIELDS, (sample[0], directory) + sample[1:]))
+
+    def export(self, path):
+        """ Writes every sample to path, as JSON when it ends in .json and CSV
+        otherwise. The file is replaced at once so readers never see half of it. """
+        temporary = path + ".tmp"
+        with open(temporary, "w", newline="", encoding="utf-8") as file:
+            if path.lower().endswith(".json"):
+                json.dump(list(self.rows()), file, indent=1)
+            else:
+                writer = csv.DictWriter(file, FIELDS)
+                writer.writeheader()
+                writer.writerows(self.rows())
+        os.replace(temporary, path)
+
+
+def format_rate(rate):
+    for unit in ("B/s", "KB/s", "MB/s"):
+        if rate < 1024:
+            return "{:.1f} {}".format(rate, unit)
+        rate /= 1024
+    return "{:.1f} GB/s".format(rate)
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "unknown"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "{}h {:02d}m".format(hours, minutes)
+    return "{}m {:02d}s".format(minutes, seconds)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# Form implementation generated from reading ui file 'untitled.ui'
+#
+# Created by: PyQt5 UI code generator 5.15.11
+#
+# WARNING: Any manual changes made to this file will be lost when pyuic5 is
+# run again.  Do not edit this file unless you know what you are doing.
+
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+
+class Ui_MainWindow(object):
+    def setupUi(self, MainWindow):
+        MainWindow.setObjectName("MainWindow")
+        MainWindow.resize(981, 971)
+        self.centralwidget = QtWidgets.QWidget(MainWindow)
+        self.centralwidget.setObjectName("centralwidget")
+        self.MplWidget = MplWidget(self.centralwidget)
+        self.MplWidget.setGeometry(QtCore.QRect(30, 10, 911, 731))
+        self.MplWidget.setObjectName("MplWidget")
+        self.filter_box = QtWidgets.QComboBox(self.centralwidget)
+        self.filter_box.setGeometry(QtCore.QRect(670, 760, 121, 21))
+        self.filter_box.setObjectName("filter_box")
+        self.filter_box.addItem("")
+        self.filter_box.addItem("")
+        self.filter_box.addItem("")
+        self.load_button = QtWidgets.QPushButton(self.centralwidget)
+        self.load_button.setGeometry(QtCore.QRect(150, 760, 121, 21))
+        self.load_button.setObjectName("load_button")
+        self.filter_freq_button = QtWidgets.QPushButton(self.centralwidget)
+        self.filter_freq_button.setGeometry(QtCore.QRect(300, 760, 121, 21))
+        self.filter_freq_button.setObjectName("filter_freq_button")
+        self.filter_time_button = QtWidgets.QPushButton(self.centralwidget)
+        self.filter_time_button.setGeometry(QtCore.QRect(450, 760, 121, 21))
+        self.filter_time_button.setObjectName("filter_time_button")
+        self.reflect_freq_box = QtWidgets.QCheckBox(self.centralwidget)
+        self.reflect_freq_box.setGeometry(QtCore.QRect(450, 790, 111, 17))
+        self.reflect_freq_box.setObjectName("reflect_freq_box")
+        self.reflect_time_box = QtWidgets.QCheckBox(self.centralwidget)
+        self.reflect_time_box.setGeometry(QtCore.QRect(300, 790, 111, 17))
+        self.reflect_time_box.setObjectName("reflect_time_box")
+        self.median_filter_slider = QtWidgets.QSlider(self.centralwidget)
+        self.median_filter_slider.setGeometry(QtCore.QRect(150, 860, 160, 22))
+        self.median_filter_slider.setMinimum(3)
+        self.median_filter_slider.setMaximum(103)
+        self.median_filter_slider.setOrientation(QtCore.Qt.Horizontal)
+        self.median_filter_slider.setObjectName("median_filter_slider")
+        self.moving_average_slider = QtWidgets.QSlider(self.centralwidget)
+        self.moving_average_slider.setGeometry(QtCore.QRect(350, 860, 160, 22))
+        self.moving_average_slider.setMinimum(3)
+        self.moving_average_slider.setMaximum(103)
+        self.moving_average_slider.setOrientation(QtCore.Qt.Horizontal)
+        self.moving_average_slider.setObjectName("moving_average_slider")
+        self.label = QtWidgets.QLabel(self.centralwidget)
+        self.label.setGeometry(QtCore.QRect(200, 840, 61, 16))
+        self.label.setObjectName("label")
+        self.label_2 = QtWidgets.QLabel(self.centralwidget)
+        self.label_2.setGeometry(QtCore.QRect(370, 840, 121, 16))
+        self.label_2.setObjectName("label_2")
+        self.label_3 = QtWidgets.QLabel(self.centralwidget)
+        self.label_3.setGeometry(QtCore.QRect(560, 840, 121, 16))
+        self.label_3.setObjectName("label_3")
+        self.reset_button = QtWidgets.QPushButton(self.centralwidget)
+        self.reset_button.setGeometry(QtCore.QRect(150, 790, 121, 21))
+        self.reset_button.setObjectName("reset_button")
+        self.save_button = QtWidgets.QPushButton(self.centralwidget)
+        self.save_button.setGeometry(QtCore.QRect(670, 790, 121, 21))
+        self.save_button.setObjectName("save_button")
+        self.cutoff_input = QtWidgets.QDoubleSpinBox(self.centralwidget)
+        self.cutoff_input.setGeometry(QtCore.QRect(560, 890, 62, 22))
+        self.cutoff_input.setObjectName("cutoff_input")
+        self.label_4 = QtWidgets.QLabel(self.centralwidget)
+        self.label_4.setGeometry(QtCore.QRect(630, 890, 47, 13))
+        self.label_4.setObjectName("label_4")
+        self.label_5 = QtWidgets.QLabel(self.centralwidget)
+        self.label_5.setGeometry(QtCore.QRect(610, 860, 47, 13))
+        self.label_5.setObjectName("label_5")
+        self.pass_zero_checkbox = QtWidgets.QCheckBox(self.centralwidget)
+        self.pass_zero_checkbox.setGeometry(QtCore.QRect(680, 860, 70, 17))
+        self.pass_zero_checkbox.setObjectName("pass_zero_checkbox")
+        self.taps_input = QtWidgets.QSpinBox(self.centralwidget)
+        self.taps_input.setGeometry(QtCore.QRect(560, 860, 50, 22))
+        self.taps_input.setMinimum(1)
+        self.taps_input.setMaximum(9999)
+        self.taps_input.setObjectName("taps_input")
+        self.spectrogram_box = QtWidgets.QCheckBox(self.centralwidget)
+        self.spectrogram_box.setGeometry(QtCore.QRect(810, 760, 121, 17))
+        self.spectrogram_box.setObjectName("spectrogram_box")
+        self.label_6 = QtWidgets.QLabel(self.centralwidget)
+        self.label_6.setGeometry(QtCore.QRect(810, 793, 51, 16))
+        self.label_6.setObjectName("label_6")
+        self.window_input = QtWidgets.QSpinBox(self.centralwidget)
+        self.window_input.setGeometry(QtCore.QRect(870, 790, 61, 22))
+        self.window_input.setMinimum(16)
+        self.window_input.setMaximum(65536)
+        self.window_input.setProperty("value", 1024)
+        self.window_input.setObjectName("window_input")
+        self.label_7 = QtWidgets.QLabel(self.centralwidget)
+        self.label_7.setGeometry(QtCore.QRect(810, 823, 51, 16))
+        self.label_7.setObjectName("label_7")
+        self.hop_input = QtWidgets.QSpinBox(self.centralwidget)
+        self.hop_input.setGeometry(QtCore.QRect(870, 820, 61, 22))
+        self.hop_input.setMinimum(1)
+        self.hop_input.setMaximum(65536)
+        self.hop_input.setProperty("value", 256)
+        self.hop_input.setObjectName("hop_input")
+        MainWindow.setCentralWidget(self.centralwidget)
+        self.menubar = QtWidgets.QMenuBar(MainWindow)
+        self.menubar.setGeometry(QtCore.QRect(0, 0, 981, 21))
+        self.menubar.setObjectName("menubar")
+        MainWindow.setMenuBar(self.menubar)
+        self.statusbar = QtWidgets.QStatusBar(MainWindow)
+        self.statusbar.setObjectName("statusbar")
+        MainWindow.setStatusBar(self.statusbar)
+
+        self.retranslateUi(MainWindow)
+        QtCore.QMetaObject.connectSlotsByName(MainWindow)
+
+    def retranslateUi(self, MainWindow):
+        _translate = QtCore.QCoreApplication.translate
+        MainWindow.setWindowTitle(_translate("MainWindow", "MainWindow"))
+        self.filter_box.setItemText(0, _translate("MainWindow", "FIR"))
+        self.filter_box.setItemText(1, _translate("MainWindow", "Median"))
+        self.filter_box.setItemText(2, _translate("MainWindow", "Moving Average"))
+        self.load_button.setText(_translate("MainWindow", "Load .wav"))
+        self.filter_freq_button.setText(_translate("MainWindow", "Filter Frequency"))
+        self.filter_time_button.setText(_translate("MainWindow", "Filter Time"))
+        self.reflect_freq_box.setText(_translate("MainWindow", "Reflect Frequency"))
+        self.reflect_time_box.setText(_translate("MainWindow", "Reflect Time"))
+        self.label.setText(_translate("MainWindow", "Median Filter"))
+        self.label_2.setText(_translate("MainWindow", "Moving Average Filter"))
+        self.label_3.setText(_translate("MainWindow", "FIR Filter"))
+        self.reset_button.setText(_translate("MainWindow", "Reset"))
+        self.save_button.setText(_translate("MainWindow", "Save Filtered"))
+        self.label_4.setText(_translate("MainWindow", "Cutoff"))
+        self.label_5.setText(_translate("MainWindow", "Tap count"))
+        self.pass_zero_checkbox.setText(_translate("MainWindow", "Pass zero"))
+        self.spectrogram_box.setText(_translate("MainWindow", "Spectrogram"))
+        self.label_6.setText(_translate("MainWindow", "Window"))
+        self.label_7.setText(_translate("MainWindow", "Hop"))
+from mplwidget import MplWidget
@@ -0,0 +1,92 @@
+# ------------------------------------------------------
+# ----------------------- vdf.py -----------------------
+# ------------------------------------------------------
+""" Parser for Valve's KeyValues text format, the .vdf and .acf files steam keeps
+its libraries and app manifests in. Files are tokenized in chunks with a single
+regular expression and built into nested dicts of strings in one pass. """
+
+import io
+import re
+
+# quoted string, brace, comment, [$PLATFORM] conditional, unquoted word,
+# and last an opening quote or bracket without its closing one
+TOKEN = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"|([{}])|//[^\n]*|(\[[^\]\n]*\])|([^\s"{}\[]+)|(["\[])', re.S)
+ESCAPE = re.compile(r"\\(.)", re.S)
+ESCAPES = {"n": "\n", "t": "\t", "\\": "\\", '"': '"'}
+CHUNK_SIZE = 64 * 2**10
+# braces are yielded as these so they can't clash with quoted "{" strings
+OPEN = object()
+CLOSE = object()
+
+
+class VDFError(ValueError):
+    pass
+
+
+def unescape(text):
+    if "\\" not in text:
+        return text
+    return ESCAPE.sub(lambda match: ESCAPES.get(match.group(1), "\\" + match.group(1)), text)
+
+
+def tokens(file, chunk_size=CHUNK_SIZE):
+    """ Yields the strings and braces of a text file object. A token that touches the
+    end of a chunk may be cut in half, it is carried over to the next chunk. """
+    buffer = ""
+    while True:
+        chunk = file.read(chunk_size)
+        end = not chunk
+        buffer += chunk
+        position = 0
+        for match in TOKEN.finditer(buffer):
+            if not end and (match.end() == len(buffer) or match.lastindex == 5):
+                position = match.start()
+                break
+            position = match.end()
+            group = match.lastindex
+            if group == 1:
+                yield unescape(match.group(1))
+            elif group == 4:
+                yield match.group(4)
+            elif group == 2:
+                yield OPEN if match.group(2) == "{" else CLOSE
+            elif group == 5:
+                raise VDFError("unterminated {}".format(
+                    "string" if match.group(5) == '"' else "conditional"))
+        else:
+            position = len(buffer)
+        buffer = buffer[position:]
+        if end:
+            return
+
+
+def load(file):
+    """ Parses a text file object into nested dicts. Keys that appear more than once
+    keep their last value, [$PLATFORM] conditionals are ignored. """
+    root = dict()
+    stack = [root]
+    key = None
+    for token in tokens(file):
+        if token is OPEN:
+            if key is None:
+                raise VDFError("block without a key")
+            block = dict()
+            stack[-1][key] = block
+            stack.append(block)
+            key = None
+        elif token is CLOSE:
+            if key is not None or len(stack) == 1:
+                raise VDFError("unexpected }")
+            stack.pop()
+        elif key is None:
+            key = token
+        else:
+            stack[-1][key] = token
+            key = None
+    if key is not None or len(stack) > 1:
+        raise VDFError("unexpected end of file")
+    return root
+
+
+def loads(text):
+    return load(io.StringIO(text))
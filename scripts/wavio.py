@@ -0,0 +1,168 @@
+# ------------------------------------------------------
+# --------------------- wavio.py -----------------------
+# ------------------------------------------------------
+""" Streaming access to wav files, so recordings don't have to fit in memory.
+Supports 8, 16, 24 and 32 bit PCM and 32/64 bit float samples with any number
+of channels. Decoded samples are floats scaled to the 16 bit range, so every
+format plots and filters the same way. """
+
+import os
+import struct
+
+import numpy as np
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# (format, bytes per sample) -> (storage dtype, scale to 16 bit units, offset)
+SAMPLE_FORMATS = {
+    (WAVE_FORMAT_PCM, 1): ("u1", 256.0, -128),
+    (WAVE_FORMAT_PCM, 2): ("<i2", 1.0, 0),
+    (WAVE_FORMAT_PCM, 3): (None, 1 / 256, 0),
+    (WAVE_FORMAT_PCM, 4): ("<i4", 1 / 65536, 0),
+    (WAVE_FORMAT_IEEE_FLOAT, 4): ("<f4", 32768.0, 0),
+    (WAVE_FORMAT_IEEE_FLOAT, 8): ("<f8", 32768.0, 0),
+}
+
+
+# walks the RIFF chunks and returns the fmt fields and the data chunk's offset and size
+def read_header(path):
+    fmt = None
+    with open(path, "rb") as file:
+        riff, _, wave_id = struct.unpack("<4sI4s", file.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError("{} is not a wav file".format(path))
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                raise ValueError("{} has no data chunk".format(path))
+            chunk_id, size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                body = file.read(size)
+                tag, channels, framerate, _, _, bits = struct.unpack("<HHIIHH", body[:16])
+                # extensible headers keep the actual format in the sub format guid
+                if tag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                    tag = struct.unpack("<H", body[24:26])[0]
+                fmt = (tag, channels, framerate, bits)
+                file.seek(size & 1, 1)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError("{} has no fmt chunk".format(path))
+                return fmt, file.tell(), size
+            else:
+                # chunks are padded to an even number of bytes
+                file.seek(size + (size & 1), 1)
+
+
+def decode_24(raw):
+    # (..., 3) little endian bytes to int32: put them in the upper three bytes
+    # of a 4 byte word, the arithmetic shift back then sign extends
+    words = np.zeros(raw.shape[:-1] + (4,), dtype=np.uint8)
+    words[..., 1:] = raw
+    return words.view("<i4")[..., 0] >> 8
+
+
+def encode_24(samples):
+    words = np.ascontiguousarray(samples, dtype="<i4")[..., np.newaxis].view(np.uint8)
+    return words[..., :3]
+
+
+class WavReader:
+    """ Reads a wav file memory mapped, as zero copy views per channel or as
+    decoded blocks of frames. """
+
+    def __init__(self, path):
+        self.path = path
+        (self.format, self.channels, self.framerate, bits), offset, size = read_header(path)
+        self.sample_width = bits // 8
+        if (self.format, self.sample_width) not in SAMPLE_FORMATS:
+            raise ValueError("unsupported wav format {} with {} bits".format(self.format, bits))
+        self.dtype, self.scale, self.offset = SAMPLE_FORMATS[(self.format, self.sample_width)]
+        # a truncated file may end before the size the data chunk claims
+        size = min(size, os.path.getsize(path) - offset)
+        self.frames = size // (self.channels * self.sample_width)
+        self.raw = np.memmap(path, dtype=np.uint8, mode="r", offset=offset,
+                             shape=(self.frames * self.channels * self.sample_width,))
+
+    def duration(self):
+        return self.frames / self.framerate
+
+    # the stored samples as a (frames, channels) array, paged in on access. 24 bit
+    # samples have no numpy type and come as (frames, channels, 3) bytes instead.
+    def memmap(self):
+        if self.dtype is None:
+            return self.raw.reshape(self.frames, self.channels, 3)
+        return self.raw.view(self.dtype).reshape(self.frames, self.channels)
+
+    # a single channel as a strided view of the memory map, nothing is copied
+    def channel(self, index=0):
+        return self.memmap()[:, index]
+
+    # converts stored samples to floats in 16 bit units
+    def decode(self, stored):
+        if self.dtype is None:
+            stored = decode_24(stored)
+        if self.dtype == "<i2":
+            return stored
+        samples = stored.astype(np.float32)
+        if self.offset:
+            samples += self.offset
+        samples *= self.scale
+        return samples
+
+    # a channel ready for plotting and filtering, 16 bit files aren't copied at all
+    def samples(self, index=0):
+        return self.decode(self.memmap()[:, index])
+
+    # yields decoded (frames, channels) arrays of at most block_size frames
+    def blocks(self, block_size=2**16):
+        stored = self.memmap()
+        for start in range(0, self.frames, block_size):
+            yield self.decode(stored[start:start + block_size])
+
+
+class WavWriter:
+    """ Writes blocks of frames in 16 bit units to a wav file as they come in,
+    encoded in any of the formats WavReader supports (16 bit PCM by default). """
+
+    def __init__(self, path, channels, framerate, sample_width=2, sample_format=WAVE_FORMAT_PCM):
+        self.dtype, self.scale, self.offset = SAMPLE_FORMATS[(sample_format, sample_width)]
+        self.channels = channels
+        self.file = open(path, "wb")
+        self.data_size = 0
+        block_align = channels * sample_width
+        self.file.write(struct.pack("<4sI4s", b"RIFF", 0, b"WAVE"))
+        self.file.write(struct.pack("<4sIHHIIHH", b"fmt ", 16, sample_format, channels, framerate,
+                                    framerate * block_align, block_align, sample_width * 8))
+        self.file.write(struct.pack("<4sI", b"data", 0))
+        self.float = sample_format == WAVE_FORMAT_IEEE_FLOAT
+        self.bits = sample_width * 8
+
+    def write(self, block):
+        samples = np.asarray(block, dtype=np.float64) / self.scale - self.offset
+        if self.float:
+            data = samples.astype(self.dtype)
+        else:
+            low, high = (0, 255) if self.offset else (-2**(self.bits - 1), 2**(self.bits - 1) - 1)
+            samples = np.clip(np.rint(samples), low, high)
+            data = encode_24(samples) if self.dtype is None else samples.astype(self.dtype)
+        data = np.ascontiguousarray(data).tobytes()
+        self.file.write(data)
+        self.data_size += len(data)
+
+    def close(self):
+        if self.data_size & 1:
+            self.file.write(b"\0")
+        # now that the size is known, fill it in the headers
+        self.file.seek(4)
+        self.file.write(struct.pack("<I", 36 + self.data_size + (self.data_size & 1)))
+        self.file.seek(40)
+        self.file.write(struct.pack("<I", self.data_size))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,114 @@
+""" Writes, grows and removes files in temporary folders and checks the activity
+the change watch backends report for them.
+
+Usage: python -m unittest discover tests """
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import changewatch  # noqa: E402
+import folderscan  # noqa: E402
+
+# seconds a wait gets to pick up the writes made before it
+WAIT = 0.05
+
+
+def write(path, size, mode="wb"):
+    with open(path, mode) as file:
+        file.write(b"\0" * size)
+
+
+class BackendTests:
+    # the activity of the first root after the writes done by act()
+    def activity(self, act):
+        act()
+        return self.backend.wait(WAIT)[self.roots[0]]
+
+    def setUp(self):
+        self.top = tempfile.mkdtemp()
+        self.roots = [os.path.join(self.top, name) for name in ("a", "b")]
+        for root in self.roots:
+            os.mkdir(root)
+        write(os.path.join(self.roots[0], "existing.bin"), 100)
+        self.backend = self.create_backend(self.roots)
+
+    def tearDown(self):
+        self.backend.close()
+        shutil.rmtree(self.top)
+
+    def test_create_grow_remove(self):
+        path = os.path.join(self.roots[0], "file.bin")
+        writes, delta = self.activity(lambda: write(path, 1000))
+        self.assertGreater(writes, 0)
+        self.assertEqual(delta, 1000)
+
+        writes, delta = self.activity(lambda: write(path, 500, "ab"))
+        self.assertGreater(writes, 0)
+        self.assertEqual(delta, 500)
+
+        writes, delta = self.activity(lambda: os.remove(path))
+        self.assertGreater(writes, 0)
+        self.assertEqual(delta, -1500)
+
+    def test_nested_folder(self):
+        def act():
+            os.makedirs(os.path.join(self.roots[0], "depot", "chunk"))
+            write(os.path.join(self.roots[0], "depot", "chunk", "file.bin"), 300)
+        self.assertEqual(self.activity(act)[1], 300)
+        self.assertEqual(self.activity(lambda: shutil.rmtree(
+            os.path.join(self.roots[0], "depot")))[1], -300)
+
+    def test_quiet(self):
+        activity = self.backend.wait(WAIT)
+        self.assertEqual(activity[self.roots[0]], (0, 0))
+        self.assertEqual(activity[self.roots[1]], (0, 0))
+
+    def test_roots_apart(self):
+        write(os.path.join(self.roots[1], "file.bin"), 700)
+        activity = self.backend.wait(WAIT)
+        self.assertEqual(activity[self.roots[0]], (0, 0))
+        self.assertEqual(activity[self.roots[1]][1], 700)
+
+    def test_missing_root(self):
+        missing = os.path.join(self.top, "missing")
+        self.backend.close()
+        self.backend = self.create_backend(self.roots + [missing])
+        write(os.path.join(self.roots[0], "file.bin"), 10)
+        activity = self.backend.wait(WAIT)
+        self.assertEqual(activity[missing], (0, 0))
+        self.assertEqual(activity[self.roots[0]][1], 10)
+
+    def test_interrupt(self):
+        threading.Timer(WAIT, self.backend.interrupt).start()
+        self.assertIsNone(self.backend.wait(60))
+        self.assertIsNone(self.backend.wait(0))
+
+    def test_close_and_interrupt(self):
+        threads = [threading.Thread(target=self.backend.close),
+                   threading.Thread(target=self.backend.interrupt)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.backend.interrupt()
+        self.backend.close()
+
+
+class PollingBackendTest(BackendTests, unittest.TestCase):
+    def create_backend(self, roots):
+        return changewatch.PollingBackend(roots, folderscan.FolderScanner().sizes)
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is only on linux")
+class InotifyBackendTest(BackendTests, unittest.TestCase):
+    def create_backend(self, roots):
+        return changewatch.InotifyBackend(roots)
+
+
+if __name__ == "__main__":
+    unittest.main()
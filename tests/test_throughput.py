@@ -0,0 +1,131 @@
+""" Feeds throughput.Throughput synthetic activity on a stubbed clock and checks
+when it calls the folders idle, its ETA and the exported samples.
+
+Usage: python -m unittest discover tests """
+
+import os
+import sys
+import csv
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+import throughput  # noqa: E402
+
+STALL_RATE = 100
+STALL_TIME = 15
+
+
+class Clock:
+    """ Stands in for the time module, only moves when told to. """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ThroughputTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(throughput, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rates = throughput.Throughput(["a", "b"], STALL_RATE, STALL_TIME)
+
+    # one sample per second for every folder in activity
+    def feed(self, seconds, activity):
+        for _ in range(seconds):
+            self.clock.sleep(1)
+            self.rates.add(activity)
+
+    def test_writing_is_not_idle(self):
+        self.feed(30, {"a": (5, 1000), "b": (5, 1000)})
+        self.assertEqual(self.rates.idle_time(), 0)
+        self.assertFalse(self.rates.idle())
+        self.assertAlmostEqual(self.rates.rate(), 2000, delta=1)
+
+    def test_idle_after_stall_time(self):
+        self.feed(10, {"a": (5, 1000), "b": (5, 1000)})
+        self.feed(STALL_TIME - 1, {"a": (1, STALL_RATE // 2), "b": (0, 0)})
+        self.assertEqual(self.rates.idle_time(), STALL_TIME - 1)
+        self.assertFalse(self.rates.idle())
+        self.feed(1, {"a": (1, STALL_RATE // 2), "b": (0, 0)})
+        self.assertTrue(self.rates.idle())
+
+    def test_one_writing_folder_keeps_the_others_busy(self):
+        self.feed(30, {"a": (5, 1000), "b": (0, 0)})
+        self.assertEqual(self.rates.series["b"].idle_time(self.clock.now), 30)
+        self.assertFalse(self.rates.idle())
+
+    def test_writes_without_size_change_are_activity(self):
+        # rewrites of preallocated files don't change the size
+        self.feed(30, {"a": (3, 0), "b": (3, 0)})
+        self.assertEqual(self.rates.idle_time(), 0)
+        self.feed(STALL_TIME, {"a": (0, 0), "b": (0, 0)})
+        self.assertTrue(self.rates.idle())
+
+    def test_unreported_folders_are_ignored(self):
+        self.assertEqual(self.rates.idle_time(), 0)
+        self.feed(STALL_TIME, {"a": (0, 0)})
+        self.assertEqual(self.rates.idle_time(), STALL_TIME)
+        self.assertTrue(self.rates.idle())
+        # folders that aren't watched don't get a series
+        self.feed(1, {"c": (5, 1000)})
+        self.assertNotIn("c", self.rates.series)
+
+    def test_negative_deltas(self):
+        # a folder that shrinks, like steam moving a finished download away
+        self.feed(STALL_TIME, {"a": (5, -1000), "b": (0, 0)})
+        series = self.rates.series["a"]
+        self.assertEqual(series.total, -1000 * STALL_TIME)
+        self.assertEqual(series.samples[-1][4], 0.0)
+        self.assertTrue(self.rates.idle())
+
+    def test_eta(self):
+        self.feed(10, {"a": (5, 1000), "b": (0, 0)})
+        self.assertAlmostEqual(self.rates.eta({"a": 10000}), 10, delta=0.01)
+        self.assertEqual(self.rates.eta({"a": 0}), 0)
+        self.assertIsNone(self.rates.eta({"a": None}))
+        # b never wrote, its rate can't tell how long it takes
+        self.assertIsNone(self.rates.eta({"b": 10000}))
+        self.assertIsNone(self.rates.eta({"c": 10000}))
+        self.assertAlmostEqual(self.rates.eta({"a": 10000, "b": None}), 10, delta=0.01)
+        self.assertIsNone(self.rates.eta(dict()))
+
+    def test_export(self):
+        self.feed(3, {"a": (5, 1000), "b": (1, -10)})
+        rows = list(self.rates.rows())
+        self.assertEqual(len(rows), 6)
+        top = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, top)
+
+        path = os.path.join(top, "rates.json")
+        self.rates.export(path)
+        with open(path, encoding="utf-8") as file:
+            self.assertEqual(json.load(file), rows)
+
+        path = os.path.join(top, "rates.csv")
+        self.rates.export(path)
+        with open(path, newline="", encoding="utf-8") as file:
+            exported = list(csv.DictReader(file))
+        self.assertEqual([row["directory"] for row in exported], [row["directory"] for row in rows])
+        for row, expected in zip(exported, rows):
+            for field in throughput.FIELDS:
+                if field != "directory":
+                    self.assertAlmostEqual(float(row[field]), expected[field])
+        self.assertEqual(sorted(os.listdir(top)), ["rates.csv", "rates.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()